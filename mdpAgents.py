@@ -35,39 +35,75 @@ import game
 import util
 import sys
 import math
+import heapq
+import collections
+import hashlib
+import array
+import os
+import time
+import json
+import multiprocessing
+from multiprocessing.sharedctypes import RawArray
+
+# NumPy is only needed for the "numpy" solver backend so the agent still runs without it
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Options given on the command line with -a reach the agent constructor as strings, so flags are
+# accepted either as booleans or as strings like "True"/"False"
+def asBool(value):
+    if isinstance(value, basestring):
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    return bool(value)
+
+# Options that count moves ("3", 3 or 3.0) - a value like 2.5 is refused rather than cut down to 2.
+def asWholeNumber(value, name):
+    number = float(value)
+    if number != int(number):
+        raise ValueError("%s must be a whole number of moves: %s" % (name, value))
+    return int(number)
 
 # Using Grid class that maps out pacman's environment from 6CCS3AIN. Week 5 - Temporal Probabilistic Reasoning. https://keats.kcl.ac.uk/course/view.php?id=66991. Last accessed 2nd Nov 2019.
 #
 #
-# The map itself is implemented as a nested list, and the interface
-# allows it to be accessed by specifying x, y locations.
+# The map itself is implemented as a flat bytearray with one cell-type code per
+# location (one byte per cell), and the interface allows it to be accessed by
+# specifying x, y locations. Values go in and come out as the map symbols.
 #
-class Grid:       
+class Grid(object):
+    __slots__ = ("width", "height", "cells")
+
+    # Cell-type codes and the symbol each one stands for. UNSET is the code of
+    # a cell that nothing has been put in yet (shown as 0).
+    UNSET = 0
+    EMPTY = 1
+    FOOD = 2
+    WALL = 3
+    symbols = (0, ' ', '*', '%')
+    codes = {0: UNSET, ' ': EMPTY, '*': FOOD, '%': WALL}
+
     # Constructor
     #
     # 
     #
-    # grid:   an array that has one position for each element in the grid.
+    # cells:  a bytearray that has one position for each element in the grid
+    #         (row by row, so (x, y) is at y * width + x).
     # width:  the width of the grid
     # height: the height of the grid
     #
     def __init__(self, width, height):
         self.width = width
         self.height = height
-        subgrid = []
-        for i in range(self.height):
-            row=[]
-            for j in range(self.width):
-                row.append(0)
-            subgrid.append(row)
-        self.grid = subgrid
+        self.cells = bytearray(width * height)
 
     # Print the grid out.
     def display(self):       
         for i in range(self.height):
             for j in range(self.width):
                 # print grid elements with no newline
-                print self.grid[i][j],
+                print self.getValue(j, i),
             # A new line after each line of the grid
             print 
         # A line after the grid
@@ -80,7 +116,7 @@ class Grid:
         for i in range(self.height):
             for j in range(self.width):
                 # print grid elements with no newline
-                print self.grid[self.height - (i + 1)][j],
+                print self.getValue(j, self.height - (i + 1)),
             # A new line after each line of the grid
             print 
         # A line after the grid
@@ -89,10 +125,17 @@ class Grid:
     # Set and get the values of specific elements in the grid.
     # Here x and y are indices.
     def setValue(self, x, y, value):
-        self.grid[y][x] = value
+        self.cells[y * self.width + x] = Grid.codes[value]
 
     def getValue(self, x, y):
-        return self.grid[y][x]
+        return Grid.symbols[self.cells[y * self.width + x]]
+
+    # Set and get the cell-type code of specific elements in the grid.
+    def setCode(self, x, y, code):
+        self.cells[y * self.width + x] = code
+
+    def getCode(self, x, y):
+        return self.cells[y * self.width + x]
 
     # Return width and height to support functions that manipulate the
     # values stored in the grid.
@@ -102,6 +145,440 @@ class Grid:
     def getWidth(self):
         return self.width
 #
+# Cache of the static structure of the MDP for each layout (the walls, the open cells and the
+# transition model) together with the utilities of the first converged solve of a game on it, so
+# back to back games on the same layout skip the setup and start from warm values.
+#
+# Layouts are told apart by a fingerprint of their dimensions and walls. The cache keeps the
+# maxEntries most recently used layouts in memory. If it is given a directory it also writes each
+# layout there as plain binary files (it's an on-disk cache, processes don't share memory through it)
+# and reads them back when the layout isn't in memory, so later processes on the same layout can
+# skip building it.
+#
+class LayoutCache:
+
+    # Constructor
+    #
+    # maxEntries: how many layouts are kept in memory (the least recently used one is dropped first)
+    # directory:  where layouts are stored on disk, None to keep them in memory only
+    #
+    def __init__(self, maxEntries=8, directory=None):
+        self.maxEntries = maxEntries
+        self.directory = directory
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if directory is not None and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    # Fingerprint of a layout: a hash of its width, height and wall locations.
+    def fingerprint(self, width, height, walls):
+        digest = hashlib.sha1("%d,%d;" % (width, height))
+        for (x, y) in sorted(walls):
+            digest.update("%d,%d;" % (x, y))
+        return digest.hexdigest()
+
+    # Return the entry of a layout (a dict with "wallCells", "coordinates", "cellIndex", "transitions",
+    # "predecessors", "sweepColours" and "utilities", plus "corridorGraph" once an agent that compresses
+    # corridors has used it) or None if the layout hasn't been seen.
+    def lookup(self, fingerprint):
+        entry = self.entries.pop(fingerprint, None)
+        if entry is None and self.directory is not None:
+            entry = self.readFromDisk(fingerprint)
+        if entry is not None:
+            self.hits += 1
+            self.remember(fingerprint, entry)
+        else:
+            self.misses += 1
+        return entry
+
+    # Add the entry of a new layout.
+    def store(self, fingerprint, entry):
+        self.remember(fingerprint, entry)
+        if self.directory is not None:
+            self.writeArray(fingerprint, "walls", entry["wallCells"])
+            cells = array.array("i")
+            for i in range(len(entry["coordinates"])):
+                cells.extend(entry["coordinates"][i])
+                cells.extend(entry["transitions"][i])
+            self.writeArray(fingerprint, "cells", cells)
+
+    # Save the warm utilities of a layout once they have been worked out.
+    def storeUtilities(self, fingerprint, entry, utilities):
+        entry["utilities"] = [float(value) for value in utilities]
+        if self.directory is not None:
+            self.writeArray(fingerprint, "utilities", array.array("d", entry["utilities"]))
+
+    # Put an entry in memory as the most recently used one, dropping the least recently used if full.
+    def remember(self, fingerprint, entry):
+        self.entries[fingerprint] = entry
+        while len(self.entries) > self.maxEntries:
+            self.entries.popitem(last=False)
+
+    # Functions for the on-disk store. Every layout has a .walls, a .cells and (once it has been
+    # solved) a .utilities file. Files are written to a temporary name first and then renamed so
+    # processes sharing the directory never see a half-written file.
+    def getPath(self, fingerprint, kind):
+        return os.path.join(self.directory, "%s.%s" % (fingerprint, kind))
+
+    def writeArray(self, fingerprint, kind, values):
+        path = self.getPath(fingerprint, kind)
+        temporaryPath = "%s.%d.tmp" % (path, os.getpid())
+        f = open(temporaryPath, "wb")
+        try:
+            f.write(bytes(values) if isinstance(values, bytearray) else values.tostring())
+        finally:
+            f.close()
+        os.rename(temporaryPath, path)
+
+    def readBytes(self, fingerprint, kind):
+        f = open(self.getPath(fingerprint, kind), "rb")
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def readFromDisk(self, fingerprint):
+        if not (os.path.exists(self.getPath(fingerprint, "walls")) and os.path.exists(self.getPath(fingerprint, "cells"))):
+            return None
+        cells = array.array("i", self.readBytes(fingerprint, "cells"))
+        coordinates = []
+        transitions = []
+        for i in range(0, len(cells), 6):
+            coordinates.append((cells[i], cells[i+1]))
+            transitions.append(tuple(cells[i+2:i+6]))
+        entry = {"wallCells": bytearray(self.readBytes(fingerprint, "walls")),
+                 "coordinates": coordinates,
+                 "transitions": transitions,
+                 "utilities": None}
+        entry["cellIndex"] = dict((coordinates[i], i) for i in range(len(coordinates)))
+        entry["predecessors"], entry["sweepColours"] = compileNeighbourhoods(coordinates, transitions)
+        if os.path.exists(self.getPath(fingerprint, "utilities")):
+            entry["utilities"] = list(array.array("d", self.readBytes(fingerprint, "utilities")))
+        return entry
+
+# Layout cache shared by every MDPAgent in this process that isn't given its own cache settings
+sharedLayoutCache = LayoutCache()
+
+#
+# Memo of solved situations. A situation is the food that is left, where the ghosts are and whether
+# they are edible (the utilities don't depend on where pacman is, so one solve covers every pacman
+# location). The memo maps a hash of the situation to the utilities that were worked out for it, so a
+# situation that comes back doesn't have to be solved again. It holds at most maxBytes of utilities,
+# dropping the least recently used situations first, and counts its hits and misses.
+#
+class SituationMemo:
+
+    # Constructor
+    #
+    # maxBytes: memory bound for the stored keys and utilities (0 turns the memo off)
+    #
+    def __init__(self, maxBytes):
+        self.maxBytes = maxBytes
+        self.usedBytes = 0
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    # Return the utilities stored for a situation (an array of doubles) or None.
+    def lookup(self, key):
+        utilities = self.entries.pop(key, None)
+        if utilities is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries[key] = utilities
+        return utilities
+
+    # Store the utilities of a situation, dropping the least recently used situations if over the bound.
+    def store(self, key, utilities):
+        if np is not None and isinstance(utilities, np.ndarray):
+            utilities = array.array("d", utilities.astype(float).tostring())
+        else:
+            utilities = array.array("d", utilities)
+        size = self.getEntrySize(key, utilities)
+        if size > self.maxBytes:
+            return
+        previous = self.entries.pop(key, None)
+        if previous is not None:
+            self.usedBytes -= self.getEntrySize(key, previous)
+        self.entries[key] = utilities
+        self.usedBytes += size
+        while self.usedBytes > self.maxBytes:
+            oldKey, oldUtilities = self.entries.popitem(last=False)
+            self.usedBytes -= self.getEntrySize(oldKey, oldUtilities)
+
+    def getEntrySize(self, key, utilities):
+        return len(key) + utilities.itemsize * len(utilities)
+
+#
+# Telemetry sink that appends every record it is given to a file as one JSON object per line
+# (JSON lines), for analysing the moves of many games offline.
+#
+class JsonLinesSink:
+
+    # Constructor
+    #
+    # path: the file the records are appended to (it is line buffered so each record reaches
+    #       the file as soon as it is written)
+    #
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "a", 1)
+
+    def __call__(self, record):
+        self.file.write(json.dumps(record, sort_keys=True) + "\n")
+
+    def close(self):
+        self.file.close()
+
+# Function getActionValues is the transition model: the (Up, Left, Down, Right) action values of a cell whose
+# (North, West, South, East) successors are at those positions of utilities. Pacman goes the way he is told with
+# probability 0.8 and to either side of it with probability 0.1. Every solver and both backends use it (with numpy
+# the successors are index arrays and it works out the action values of many cells at once), so they all do the
+# same arithmetic and end up with the same utilities
+def getActionValues(utilities, north, west, south, east):
+    north = utilities[north]
+    west = utilities[west]
+    south = utilities[south]
+    east = utilities[east]
+    return (0.8 * north + 0.1 * west + 0.1 * east,
+            0.8 * west + 0.1 * south + 0.1 * north,
+            0.8 * south + 0.1 * east + 0.1 * west,
+            0.8 * east + 0.1 * north + 0.1 * south)
+
+# Function compileNeighbourhoods works out what the solvers need on top of the transition model: the predecessors
+# of each cell (the cells whose Bellman update reads it, these have to be looked at again when its utility changes;
+# a cell next to a wall reads its own utility, so it is one of its own predecessors) and the red ((x + y) even) and
+# black ((x + y) odd) cells used by the in-place sweeps
+def compileNeighbourhoods(coordinates, transitions):
+    predecessors = [[] for i in range(len(transitions))]
+    for i in range(len(transitions)):
+        for successor in set(transitions[i]):
+            predecessors[successor].append(i)
+
+    redCells = [i for i in range(len(coordinates)) if sum(coordinates[i]) % 2 == 0]
+    blackCells = [i for i in range(len(coordinates)) if sum(coordinates[i]) % 2 == 1]
+    return predecessors, (redCells, blackCells)
+
+# Function compileCorridorGraph builds the junction graph used when corridors are compressed. An open cell with
+# open neighbours on two opposite sides only (walls on the other two) is a corridor cell and every other open cell
+# (junctions, dead ends and bends) is a node; each chain of corridor cells between two nodes becomes one corridor.
+# Corridors are straight so that a step along one is what getCorridorStep assumes: slipping to either side runs into
+# a wall. At a bend one of the slips moves pacman on along the corridor instead, so bends have to be solved as nodes
+# with the full Bellman update. Returns:
+#   nodes:        the cell index of each node
+#   nodeOf:       the node index of each cell (None for corridor cells)
+#   nodeExits:    the (North, West, South, East) exits of each node. An exit is (None, node) when it leads straight
+#                 to a node (the node itself when that side is a wall), (corridor, True) when it goes into the start
+#                 of a corridor and (corridor, False) when it goes into its end
+#   corridors:    (cells, start node, end node) of each corridor, the cells in order from the start node
+#   cellCorridor: the (corridor, position) of each corridor cell (None for nodes)
+def compileCorridorGraph(transitions):
+    count = len(transitions)
+    nodes = []
+    nodeOf = [None] * count
+    nodeExits = []
+    corridors = []
+    cellCorridor = [None] * count
+    neighbours = [None] * count # the two neighbours of each corridor cell
+    for i in range(count):
+        north, west, south, east = transitions[i]
+        if north == i and south == i and west != i and east != i:
+            neighbours[i] = (west, east)
+        elif west == i and east == i and north != i and south != i:
+            neighbours[i] = (north, south)
+        else:
+            nodeOf[i] = len(nodes)
+            nodes.append(i)
+
+    # every corridor runs between two nodes (a ring of corridor cells would need bends), so it is found by going
+    # along it from the nodes at its ends
+    for node in range(len(nodes)):
+        exits = []
+        for j in transitions[nodes[node]]:
+            if nodeOf[j] is not None:
+                exits.append((None, nodeOf[j]))
+            elif cellCorridor[j] is not None:
+                # the corridor was already followed from its other end
+                corridor, position = cellCorridor[j]
+                exits.append((corridor, position == 0 and corridors[corridor][1] == node))
+            else:
+                # follow the corridor until it reaches a node
+                cells = [j]
+                previous, current = nodes[node], j
+                while True:
+                    following = neighbours[current][0] if neighbours[current][1] == previous else neighbours[current][1]
+                    if nodeOf[following] is not None:
+                        break
+                    cells.append(following)
+                    previous, current = current, following
+                for position in range(len(cells)):
+                    cellCorridor[cells[position]] = (len(corridors), position)
+                exits.append((len(corridors), True))
+                corridors.append((cells, node, nodeOf[following]))
+        nodeExits.append(tuple(exits))
+
+    return nodes, nodeOf, nodeExits, corridors, cellCorridor
+
+# Function makeTiles splits the open cells into count bands of whole rows with about the same number of cells each.
+# The cells are numbered row by row, so a band is the range of cell indices lo to hi. Its Bellman updates read the
+# rows just below and above it as well (the halo), so the cells haloLo to haloHi are what a sweep of it needs.
+# Returns (lo, hi, haloLo, haloHi) for each band
+def makeTiles(coordinates, count):
+    rows = [] # [y, first cell, end] of each row that has open cells
+    for i in range(len(coordinates)):
+        if rows and rows[-1][0] == coordinates[i][1]:
+            rows[-1][2] = i + 1
+        else:
+            rows.append([coordinates[i][1], i, i + 1])
+
+    tiles = []
+    first = 0
+    for row in range(len(rows)):
+        if rows[row][2] * count >= (len(tiles) + 1) * len(coordinates) or row == len(rows) - 1:
+            haloLo = rows[first - 1][1] if first > 0 else rows[first][1]
+            haloHi = rows[row + 1][2] if row + 1 < len(rows) else rows[row][2]
+            tiles.append((rows[first][1], rows[row][2], haloLo, haloHi))
+            first = row + 1
+    return tiles
+
+# Function runTileWorker is the loop of a worker process of the tiled solver. The utilities live in two shared
+# buffers, each sweep reads one and writes the other (a Jacobi sweep), so the workers never see a half-finished
+# sweep of a neighbouring band. For every sweep the worker gets (source buffer, emptyTileCost, gamma, whether the
+# fixed utilities changed) on its connection, updates the cells of its band with the same arithmetic as
+# calculateNextIterationValues (calculateNextIterationValuesNumpy when useNumpy is set) and sends back the max change
+# of a utility in the band. None stops the worker
+def runTileWorker(connection, buffers, fixedMask, fixedValues, transitions, tile, useNumpy):
+    lo, hi, haloLo, haloHi = tile
+    if useNumpy:
+        views = [np.frombuffer(buffer, dtype=float) for buffer in buffers]
+        tileTransitions = np.frombuffer(transitions, dtype=np.int32).reshape(-1, 4)[lo:hi]
+        northIndices, westIndices, southIndices, eastIndices = [tileTransitions[:, d].astype(int) for d in range(4)]
+    else:
+        # successors relative to the start of the halo, which is the part of the utilities a sweep copies
+        tileTransitions = [tuple(transitions[4 * i + d] - haloLo for d in range(4)) for i in range(lo, hi)]
+    while True:
+        message = connection.recv()
+        if message is None:
+            break
+        source, emptyTileCost, gamma, fixedChanged = message
+        if fixedChanged:
+            if useNumpy:
+                mask = np.frombuffer(fixedMask, dtype=np.int8)[lo:hi].astype(bool)
+                values = np.frombuffer(fixedValues, dtype=float)[lo:hi].copy()
+            else:
+                mask = fixedMask[lo:hi]
+                values = fixedValues[lo:hi]
+
+        if useNumpy:
+            utilities = views[source]
+            upValues, leftValues, downValues, rightValues = getActionValues(utilities, northIndices, westIndices, southIndices, eastIndices)
+            maxUtilityValues = np.maximum(np.maximum(upValues, leftValues), np.maximum(downValues, rightValues))
+            newValues = np.where(mask, values, emptyTileCost + (gamma * maxUtilityValues))
+            residual = float(np.max(np.abs(newValues - utilities[lo:hi])))
+            views[1 - source][lo:hi] = newValues
+        else:
+            utilities = buffers[source][haloLo:haloHi] # the band and its halo rows, as they were after the last sweep
+            offset = lo - haloLo
+            newValues = []
+            residual = 0
+            for k in range(hi - lo):
+                if mask[k]:
+                    value = values[k]
+                else:
+                    north, west, south, east = tileTransitions[k]
+                    value = emptyTileCost + (gamma * max(getActionValues(utilities, north, west, south, east)))
+                residual = max(residual, abs(value - utilities[offset + k]))
+                newValues.append(value)
+            buffers[1 - source][lo:hi] = newValues
+        connection.send(residual)
+    connection.close()
+
+#
+# Multi-core value iteration for big layouts. The open cells are split into bands of rows (tiles), one per worker
+# process, and the utilities, the fixed utilities and the transition model are kept in shared memory. Each sweep
+# every worker updates its band from the previous sweep's buffer (reading the halo rows of its neighbours straight
+# from it) into the other buffer, and the maximum of the workers' residuals is the residual of the sweep. Since a
+# Jacobi sweep updates every cell from the previous sweep only, this gives exactly the same utilities as the serial
+# value solver. The workers are started for one layout and kept until the solver is closed.
+#
+class TiledSolver:
+
+    # Constructor
+    #
+    # fingerprint: layout cache fingerprint of the layout the solver is set up for
+    # coordinates, transitions: the open cells and transition model of the layout (see compileTransitions)
+    # workers: number of worker processes (and tiles)
+    # useNumpy: whether the workers sweep their band with numpy
+    #
+    def __init__(self, fingerprint, coordinates, transitions, workers, useNumpy):
+        self.fingerprint = fingerprint
+        self.useNumpy = useNumpy
+        self.buffers = (RawArray("d", len(transitions)), RawArray("d", len(transitions)))
+        self.fixedMask = RawArray("b", len(transitions))
+        self.fixedValues = RawArray("d", len(transitions))
+        sharedTransitions = RawArray("i", 4 * len(transitions))
+        sharedTransitions[:] = [successor for successors in transitions for successor in successors]
+        self.tiles = makeTiles(coordinates, max(1, min(workers, len(transitions))))
+        self.connections = []
+        self.processes = []
+        for tile in self.tiles:
+            connection, workerConnection = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=runTileWorker,
+                                              args=(workerConnection, self.buffers, self.fixedMask, self.fixedValues,
+                                                    sharedTransitions, tile, useNumpy))
+            process.daemon = True # workers don't keep the game from exiting
+            process.start()
+            self.connections.append(connection)
+            self.processes.append(process)
+
+    # Put the fixed utilities of this move (a list with None for the cells that get the Bellman update) in shared memory.
+    def setFixedUtilities(self, fixedUtilities):
+        self.fixedMask[:] = [value is not None for value in fixedUtilities]
+        self.fixedValues[:] = [value if value is not None else 0.0 for value in fixedUtilities]
+
+    # Same as setFixedUtilities for the fixedMask and fixedValues arrays of the numpy backend.
+    def setFixedArrays(self, fixedMask, fixedValues):
+        np.frombuffer(self.fixedMask, dtype=np.int8)[:] = fixedMask
+        np.frombuffer(self.fixedValues, dtype=float)[:] = fixedValues
+
+    # Copy utilities into one of the buffers, or out of it (as a list, or an array with numpy).
+    def setUtilities(self, buffer, utilities):
+        if self.useNumpy:
+            np.frombuffer(self.buffers[buffer], dtype=float)[:] = utilities
+        else:
+            self.buffers[buffer][:] = utilities
+
+    def getUtilities(self, buffer):
+        if self.useNumpy:
+            return np.frombuffer(self.buffers[buffer], dtype=float).copy()
+        return self.buffers[buffer][:]
+
+    # Run one sweep from the source buffer into the other one and return its residual. Sending every worker its
+    # message and then waiting for all the answers is the barrier between sweeps.
+    def sweep(self, source, emptyTileCost, gamma, fixedChanged):
+        for connection in self.connections:
+            connection.send((source, emptyTileCost, gamma, fixedChanged))
+        return max([connection.recv() for connection in self.connections] + [0])
+
+    # Stop the workers.
+    def close(self):
+        for connection in self.connections:
+            try:
+                connection.send(None)
+                connection.close()
+            except (IOError, OSError):
+                pass # the worker has already gone
+        for process in self.processes:
+            process.join(1)
+        self.connections = []
+        self.processes = []
+
+    def __del__(self):
+        self.close()
+
+#
 # An agent that creates a map.
 #
 # As currently implemented, the map places a % for each section of
@@ -112,47 +589,237 @@ class Grid:
 class MDPAgent(Agent):
 
     # Constructor: this gets run when we first invoke pacman.py
-    def __init__(self):
-        self.foodCost = 1.5 # Food cost variable corresponds to the cost of all cells that have food items in them
-        self.emptyTileCost = -0.2 # Empty tile variable corresponds to the cost of all cells that are empty
-        self.ghostCost = -10 # Ghost cost variable corresponds to the cost of cells that have a ghost in them
-        self.edibleGhostCost = 0 # Edible ghost cost variable corresponds to the cells that have edible ghosts in them
+    #
+    # backend: "python" runs each Bellman sweep as a loop over the cells, "numpy" keeps the utilities,
+    #          rewards and transition model as arrays and updates every cell at once in each sweep
+    #          (select it with: python pacman.py -p MDPAgent -a backend=numpy)
+    # incremental: keep the utilities of the previous move and only re-solve around the cells whose reward
+    #              changed (eaten food, moved ghosts) with prioritized sweeping instead of running the
+    #              full 30-sweep loop every move (-a incremental=True)
+    # solver: "value" is Jacobi value iteration (every cell updated from the previous sweep), "gaussSeidel" updates
+    #         the cells in place, "policy" is policy iteration and "modifiedPolicy" is modified policy iteration
+    #         which only runs evaluationSweeps sweeps of policy evaluation per improvement step. "parallel" is the
+    #         value solver split over worker processes (see TiledSolver), it gives the same utilities on more cores
+    #         (incremental off only)
+    # epsilon: solving stops once the max-norm Bellman residual drops to epsilon * (1 - gamma) / gamma, which keeps
+    #          the utilities within epsilon of the optimal ones (0 only stops when the utilities stop changing)
+    # maxIterations: cap on the sweeps of a solve (on the policy improvement steps for the policy solvers)
+    # cacheSize, cacheDirectory: settings of the layout cache for this agent (how many layouts it keeps in memory and
+    #                           where it stores them on disk); by default agents share one in-memory cache
+    # memoBytes: memory bound of the memo of solved situations (food left, ghost cells and edible ghosts), 0 turns it off
+    # timeBudget: seconds each move may take (anytime mode). The solver keeps sweeping until the deadline instead of
+    #             stopping after maxIterations (it doesn't start a sweep that wouldn't end in time), and the move is made
+    #             from whatever utilities it has by then. The telemetry records say when the work before the first sweep
+    #             already took the whole budget (preparationOverBudget)
+    # quiet: don't print anything (the map, corners and iteration counts are printed otherwise)
+    # telemetry: a hook (any callable) that gets a dict for every setup and move with timings, sweep counts, the final
+    #            residual and cache statistics, or the path of a JSON lines file to write them to. More hooks can be
+    #            added with addTelemetryHook; without any no timings are taken at all
+    # foodCost, emptyTileCost, ghostCost, edibleGhostCost, gamma, smallGridAvoidDistance, avoidDistance: the rewards,
+    #            discount factor and ghost avoid distances described below, given here so they can be tuned
+    #            (-a foodCost=2,gamma=0.9); final() puts them back to these values after every game
+    # compressCorridors: solve on the junction graph instead of on every cell. Corridors (straight chains of cells with open
+    #                    neighbours on two opposite sides) become weighted edges between the junctions, bends and dead
+    #                    ends at their ends, value
+    #                    iteration runs over those nodes only and the utilities of the cells pacman can move to are
+    #                    worked out from the nodes each move (python backend, value or gaussSeidel solver only)
+    # horizon: only solve the cells within this many moves of pacman (receding horizon, None solves the whole layout).
+    #          The cells at the edge of the window are pinned to a food distance potential, what getting to the nearest
+    #          food is worth from there, so the cost of a move depends on the window and not on the size of the layout
+    #          (python backend, value or gaussSeidel solver only)
+    # workers: number of worker processes of the parallel solver (None for one per core)
+    def __init__(self, backend="python", incremental=False, solver="value", epsilon=0.001, maxIterations=30,
+                 evaluationSweeps=5, cacheSize=None, cacheDirectory=None, memoBytes=16 * 1024 * 1024, timeBudget=None,
+                 quiet=False, telemetry=None, foodCost=1.5, emptyTileCost=-0.2, ghostCost=-10, edibleGhostCost=0,
+                 gamma=0.925, smallGridAvoidDistance=2, avoidDistance=3, compressCorridors=False,
+                 horizon=None, workers=None):
+        if backend not in ("python", "numpy"):
+            raise ValueError("Unknown MDPAgent backend: %s" % backend)
+        if backend == "numpy" and np is None:
+            raise ImportError("The numpy backend of MDPAgent requires NumPy to be installed")
+        if solver not in ("value", "gaussSeidel", "policy", "modifiedPolicy", "parallel"):
+            raise ValueError("Unknown MDPAgent solver: %s" % solver)
+        if solver == "parallel" and asBool(incremental):
+            raise ValueError("The parallel solver only works with incremental off")
+        self.compressCorridors = asBool(compressCorridors)
+        if self.compressCorridors and (backend != "python" or asBool(incremental) or solver not in ("value", "gaussSeidel")):
+            raise ValueError("compressCorridors only works with the python backend, the value or gaussSeidel solver and incremental off")
+        self.horizon = None if horizon is None else int(horizon)
+        if self.horizon is not None and self.horizon < 1:
+            raise ValueError("MDPAgent horizon must be at least 1: %d" % self.horizon)
+        if self.horizon is not None and (backend != "python" or asBool(incremental) or solver not in ("value", "gaussSeidel") or self.compressCorridors):
+            raise ValueError("horizon only works with the python backend, the value or gaussSeidel solver, incremental off and compressCorridors off")
+        self.backend = backend
+        self.incremental = asBool(incremental)
+        self.solver = solver
+        self.epsilon = float(epsilon)
+        self.maxIterations = int(maxIterations)
+        self.evaluationSweeps = int(evaluationSweeps)
+        self.timeBudget = None if timeBudget is None else float(timeBudget)
+        self.quiet = asBool(quiet)
+        self.telemetryHooks = [] # Callables that get the telemetry records, see addTelemetryHook
+        if isinstance(telemetry, basestring):
+            self.addTelemetryHook(JsonLinesSink(telemetry))
+        elif telemetry is not None:
+            self.addTelemetryHook(telemetry)
+        self.workers = multiprocessing.cpu_count() if workers is None else int(workers)
+        self.tiledSolver = None # Worker processes of the parallel solver, set up for the current layout
+        self.gameCount = 0 # Number of games started by this agent (used to label telemetry records)
+        self.moveCount = 0 # Number of moves made in the current game
+        self.deadline = None # time.time() at which the solve of this move has to stop (anytime mode only)
+        self.stepStart = None # time.time() at which the current sweep (or policy improvement step) started (anytime mode only)
+        self.preparationOverBudget = False # whether the deadline had already passed when the solve of this move was about to start
+        if cacheSize is None and cacheDirectory is None:
+            self.layoutCache = sharedLayoutCache
+        else:
+            self.layoutCache = LayoutCache(8 if cacheSize is None else int(cacheSize), cacheDirectory)
+        self.layoutFingerprint = None # Fingerprint of the current layout in the layout cache
+        self.layoutEntry = None # Layout cache entry of the current layout
+        self.situationMemo = SituationMemo(int(memoBytes)) # Utilities of the situations already solved (kept between games)
+
+        self.foodCost = float(foodCost) # Food cost variable corresponds to the cost of all cells that have food items in them
+        self.emptyTileCost = float(emptyTileCost) # Empty tile variable corresponds to the cost of all cells that are empty
+        self.ghostCost = float(ghostCost) # Ghost cost variable corresponds to the cost of cells that have a ghost in them
+        self.edibleGhostCost = float(edibleGhostCost) # Edible ghost cost variable corresponds to the cells that have edible ghosts in them
+        self.smallGridAvoidDistance = asWholeNumber(smallGridAvoidDistance, "smallGridAvoidDistance") # Food within this many moves of a dangerous ghost isn't pinned to foodCost on grids of 7x7 or smaller
+        self.avoidDistance = asWholeNumber(avoidDistance, "avoidDistance") # Same as smallGridAvoidDistance but for bigger grids, where pacman has more space to get away
+        # the values above (and gamma) as given to the constructor, final() resets to them between games
+        self.initialCosts = (self.foodCost, self.emptyTileCost, self.ghostCost, self.edibleGhostCost, float(gamma))
 
         self.expectedUtilities = [] # Stores the collection of all expected Utilities for each cell (post-value-iteration process)
         self.coordinatesOfEachEXField = [] # Stores coordinates that correspond to the locations of the expected utilities (same indexes as self.expectedUtilities)
-        self.iterationCount = 0 # keeps count of the number of iterations until the values in self.expectedUtilities stop changing (used only for display)
-        self.gamma = 0.925 # Gamma variable is the discount factor (between value 0 and 1) and models the preference of the agent for current over future rewards
+        self.cellIndex = {} # Maps the coordinates of each cell to its index in self.expectedUtilities (built once by compileTransitions)
+        self.transitions = [] # Stores the indices of the (North, West, South, East) successors of each cell (built once by compileTransitions)
+        self.fixedUtilities = [] # Stores the utility each cell is pinned to during this move (food, ghosts) or None if it gets a Bellman update (the numpy backend only keeps it for incremental mode, see calculateFixedArrays)
+        self.foodInMap = None # Stores the set of food locations currently marked in self.map (None for a new map)
+        self.foodBits = None # Bitset over the cell indices of the food that is left, for the situation key (None until it is first needed in a game)
+        self.foodDigest = None # SHA-1 of the layout and self.foodBits, the part of the situation key that only changes when food is eaten
+        self.ghostDistances = [] # Maze distance from each cell to the nearest dangerous ghost this move (None if further than the avoid distance)
+        self.ghostOccupancy = {} # Maps the index of each cell that has a ghost in it to True if every ghost in the cell is edible
+        self.ghostFieldCells = [] # Indices of the cells within the avoid distance of a dangerous ghost this move (those with a ghost distance)
+        self.eatenCells = None # Indices of the cells whose food has gone since calculateCellRewards last ran (None until it has run in this game)
+        self.changedCells = None # Indices of the cells whose fixed utility calculateCellRewards changed on its last run (None when it set up every cell)
+        self.queueCarriedOver = False # whether the utilities and sweep queue of the previous move's prioritized sweeping are carried over to this one
+        self.sweepQueue = [] # Priority queue of (-Bellman residual, cell index) still to be backed up in incremental mode
+        self.nodeUtilities = [] # Utility of each node of the junction graph (compressCorridors only, see compileCorridorGraph)
+        self.corridorStep = None # (reward, discount) of one step along a corridor, see getCorridorStep
+        self.foodDistances = [] # Maze distance from each cell to the nearest food (horizon only, None where no food can be reached)
+        self.windowCells = [] # Cells of the window solved this move in horizon mode (see calculateHorizonWindow)
+        self.corridorEntries = [] # (forward, backward) utility of the first cell of each corridor as (constant, factor, node) this move
+        self.backupCount = 0 # Number of single-cell backups carried out by incremental mode during the last move
+        self.iterationCount = 0 # keeps count of the number of sweeps the last solve used (used only for display)
+        self.finalResidual = 0 # max-norm Bellman residual at the end of the last solve
+        self.converged = True # whether the last solve got its residual down to residualThreshold (in anytime mode it may not have)
+        self.gamma = float(gamma) # Gamma variable is the discount factor (between value 0 and 1) and models the preference of the agent for current over future rewards
 
     # Gets run after an MDPAgent object is created and assigns initial state and costs (initial state of the value iteration process)
+    #
+    # The walls, open cells and transition model only depend on the layout, so when the layout is already in the
+    # layout cache they are taken from there and the utilities start from the warm values stored for it
     def registerInitialState(self, state):
+         instrumented = bool(self.telemetryHooks) # timings are only taken when something listens for them
+         if instrumented:
+             setupStart = time.time()
+         self.gameCount += 1
+         self.moveCount = 0
+         self.foodBits = None
+         self.foodDigest = None
+         layoutCacheHits = self.layoutCache.hits
+
          # Makes a map of the right size (according to the grid)
          self.makeMap(state)
-         self.addWallsToMap(state)
+         self.layoutFingerprint = self.layoutCache.fingerprint(self.map.getWidth(), self.map.getHeight(), api.walls(state))
+         self.layoutEntry = self.layoutCache.lookup(self.layoutFingerprint)
+         if self.layoutEntry is None:
+             self.addWallsToMap(state)
+             wallCells = bytearray(self.map.cells)
+         else:
+             self.map.cells[:] = self.layoutEntry["wallCells"]
          self.updateFoodInMap(state)
-         self.map.display()
+         if not self.quiet:
+             self.map.display()
+
+         if self.layoutEntry is None:
+             self.expectedUtilities = []
+             self.coordinatesOfEachEXField = []
+             MDPAgent.setInitialStateInfo(self,state, self.foodCost, 0) # sets initial state for the expected utilities (all cells starting from zero except food cells)
+             self.compileTransitions() # the layout doesn't change during a game so the transition model is only built here
+             self.layoutEntry = {"wallCells": wallCells,
+                                 "coordinates": self.coordinatesOfEachEXField,
+                                 "cellIndex": self.cellIndex,
+                                 "transitions": self.transitions,
+                                 "predecessors": self.predecessors,
+                                 "sweepColours": self.sweepColours,
+                                 "utilities": None}
+             self.layoutCache.store(self.layoutFingerprint, self.layoutEntry)
+         else:
+             self.coordinatesOfEachEXField = self.layoutEntry["coordinates"]
+             self.cellIndex = self.layoutEntry["cellIndex"]
+             self.transitions = self.layoutEntry["transitions"]
+             self.predecessors = self.layoutEntry["predecessors"]
+             self.sweepColours = self.layoutEntry["sweepColours"]
+             if self.layoutEntry["utilities"] is not None:
+                 self.expectedUtilities = list(self.layoutEntry["utilities"])
+             else:
+                 self.expectedUtilities = [self.foodCost if self.map.getCode(x, y) == Grid.FOOD else 0 for (x, y) in self.coordinatesOfEachEXField]
+         self.prepareBackend()
+         if self.compressCorridors:
+             if self.layoutEntry.get("corridorGraph") is None:
+                 self.layoutEntry["corridorGraph"] = compileCorridorGraph(self.transitions)
+             self.graphNodes, self.nodeOf, self.nodeExits, self.corridors, self.cellCorridor = self.layoutEntry["corridorGraph"]
+             self.nodeUtilities = [self.expectedUtilities[i] for i in self.graphNodes]
+         if self.horizon is not None:
+             self.calculateFoodDistances()
+         if self.solver == "parallel" and (self.tiledSolver is None or self.tiledSolver.fingerprint != self.layoutFingerprint):
+             # the workers are kept between games and only started again when the layout changes
+             if self.tiledSolver is not None:
+                 self.tiledSolver.close()
+             self.tiledSolver = TiledSolver(self.layoutFingerprint, self.coordinatesOfEachEXField, self.transitions,
+                                            self.workers, self.backend == "numpy")
+         self.ghostDistances = [None] * len(self.coordinatesOfEachEXField)
+         self.ghostOccupancy = {}
+         self.ghostFieldCells = []
+         self.eatenCells = None
+         self.queueCarriedOver = False
+         self.sweepQueue = []
+         if self.horizon is None:
+             # the rewards of every cell are worked out here (and pinned for the solvers that need it, or queued up for
+             # incremental mode), so that a move only has to look at the cells that changed
+             self.calculateCellRewards(state)
+             if self.incremental:
+                 self.seedSweepQueue()
+             elif self.solver in ("gaussSeidel", "policy", "modifiedPolicy"):
+                 self.applyFixedUtilities()
 
-         MDPAgent.setInitialStateInfo(self,state, self.foodCost, 0) # sets initial state for the expected utilities (all cells starting from zero except food cells)
+         if instrumented:
+             self.emitTelemetry({"event": "setup",
+                                 "game": self.gameCount,
+                                 "cells": len(self.coordinatesOfEachEXField),
+                                 "graphNodes": len(self.graphNodes) if self.compressCorridors else None,
+                                 "setupMs": (time.time() - setupStart) * 1000,
+                                 "layoutCacheHit": self.layoutCache.hits > layoutCacheHits})
 
-    # Final function to keep the costs the same between games and reset the expected utility values to their initial state
+    # Final function to keep the costs the same between games and clear the expected utility values (the next game
+    # sets them up again in registerInitialState, from the layout cache when it's the same layout)
     def final(self, state):
-        self.foodCost = 1.5
-        self.emptyTileCost = -0.2
-        self.ghostCost = -10
-        self.edibleGhostCost = 0
+        self.foodCost, self.emptyTileCost, self.ghostCost, self.edibleGhostCost, self.gamma = self.initialCosts
 
         self.expectedUtilities = []
         self.coordinatesOfEachEXField = []
+        self.nodeUtilities = []
         self.iterationCount = 0
-        self.gamma = 0.925
-        MDPAgent.setInitialStateInfo(self,state, self.foodCost, 0)
+        self.queueCarriedOver = False
+        self.sweepQueue = []
 
     # Make a map by creating a grid of the right size
     def makeMap(self,state):
         corners = api.corners(state)
-        print corners
+        if not self.quiet:
+            print corners
         height = self.getLayoutHeight(corners)
         width  = self.getLayoutWidth(corners)
         self.map = Grid(width, height)
+        self.foodInMap = None # the food currently marked in self.map, set by updateFoodInMap
         
     # Functions to get the height and the width of the grid.
     #
@@ -181,15 +848,42 @@ class MDPAgent(Agent):
             self.map.setValue(walls[i][0], walls[i][1], '%')
 
     # Create a map with a current picture of the food that exists.
+    #
+    # The first time (self.foodInMap is None, i.e. a new map) every grid element that isn't
+    # a wall is made blank and all the food is added. After that only the cells whose food
+    # changed since the last call are touched. Returns the cells whose food has gone since
+    # the last call.
+    #
+    # Food only ever goes by pacman eating it, so when there is as much food as last time
+    # nothing has changed, and when one piece has gone and pacman stands on a cell that had
+    # food it's that one. Only other changes need the sets of food compared.
     def updateFoodInMap(self, state):
-        # First, make all grid elements that aren't walls blank.
-        for i in range(self.map.getWidth()):
-            for j in range(self.map.getHeight()):
-                if self.map.getValue(i, j) != '%':
-                    self.map.setValue(i, j, ' ')
         food = api.food(state)
-        for i in range(len(food)):
-            self.map.setValue(food[i][0], food[i][1], '*')
+        if self.foodInMap is not None and len(food) == len(self.foodInMap):
+            return ()
+        if self.foodInMap is not None and len(food) == len(self.foodInMap) - 1:
+            pacman = api.whereAmI(state)
+            if pacman in self.foodInMap:
+                self.foodInMap.discard(pacman)
+                self.map.setCode(pacman[0], pacman[1], Grid.EMPTY)
+                return (pacman,)
+        food = set(food)
+        if self.foodInMap is None:
+            for i in range(self.map.getWidth()):
+                for j in range(self.map.getHeight()):
+                    if self.map.getCode(i, j) != Grid.WALL:
+                        self.map.setCode(i, j, Grid.EMPTY)
+            changedToFood = food
+            changedToEmpty = ()
+        else:
+            changedToFood = food - self.foodInMap
+            changedToEmpty = self.foodInMap - food
+        for (x, y) in changedToEmpty:
+            self.map.setCode(x, y, Grid.EMPTY)
+        for (x, y) in changedToFood:
+            self.map.setCode(x, y, Grid.FOOD)
+        self.foodInMap = food
+        return changedToEmpty
 
     # Functions for MDP Agent
     #
@@ -207,192 +901,891 @@ class MDPAgent(Agent):
                     self.expectedUtilities.append(foodCost)
                     self.coordinatesOfEachEXField.append((j,i))
 
+    # Function compileTransitions builds the transition model once per layout. Every open cell gets a dense
+    # index (self.cellIndex maps coordinates to that index) and self.transitions stores, for each index, the
+    # indices of its (North, West, South, East) successors. A wall resolves to the cell itself because pacman
+    # stays in place when he hits a wall, so the Bellman update below only needs array indexing
+    def compileTransitions(self):
+        self.cellIndex = {}
+        for i in range(len(self.coordinatesOfEachEXField)):
+            self.cellIndex[self.coordinatesOfEachEXField[i]] = i
+
+        self.transitions = []
+        for i in range(len(self.coordinatesOfEachEXField)):
+            x, y = self.coordinatesOfEachEXField[i]
+            self.transitions.append((self.cellIndex.get((x, y+1), i),   # North
+                                     self.cellIndex.get((x-1, y), i),   # West
+                                     self.cellIndex.get((x, y-1), i),   # South
+                                     self.cellIndex.get((x+1, y), i)))  # East
+
+        self.predecessors, self.sweepColours = compileNeighbourhoods(self.coordinatesOfEachEXField, self.transitions)
+
+    # Function prepareBackend converts the utilities and the transition model to what the chosen backend works on
+    def prepareBackend(self):
+        if self.backend == "numpy":
+            # the numpy backend keeps the utilities and each column of the transition table as arrays
+            self.expectedUtilities = np.array(self.expectedUtilities, dtype=float)
+            transitionArray = np.array(self.transitions, dtype=int).reshape(-1, 4)
+            self.northIndices = transitionArray[:, 0]
+            self.westIndices = transitionArray[:, 1]
+            self.southIndices = transitionArray[:, 2]
+            self.eastIndices = transitionArray[:, 3]
+            self.sweepColours = tuple(np.array(cells, dtype=int) for cells in self.sweepColours)
+            # position of each open cell in self.map.cells, to read the cell-type codes of all of them at once
+            self.mapPositions = np.array([y * self.map.getWidth() + x for (x, y) in self.coordinatesOfEachEXField], dtype=int)
+
+    # Function getAvoidDistance gives the number of moves from a dangerous ghost within which food stops being pinned
+    # to foodCost. I set the avoid distance smaller if the grid is below or equal to 7x7 because pacman doesn't have
+    # as much space to move around in smaller grids to avoid the ghost/ghosts
+    def getAvoidDistance(self):
+        if self.map.getHeight() <= 7 or self.map.getWidth() <= 7:
+            return self.smallGridAvoidDistance
+        return self.avoidDistance
+
+    # Function getGhostCells returns the cells a ghost is in. Ghosts that are moving between two cells have
+    # half-integer coordinates, in which case they count as being in both cells
+    def getGhostCells(self, ghostPosition):
+        x, y = ghostPosition
+        return set([(int(math.floor(x)), int(math.floor(y))), (int(math.ceil(x)), int(math.ceil(y)))])
+
+    # Function calculateGhostField builds the ghost influence field once per move: which cells have a ghost in them
+    # (and whether those ghosts are edible) and the maze distance from each cell to the nearest dangerous ghost.
+    # The distances come from a breadth first search started from every dangerous ghost at once, stopped at the
+    # avoid distance since cells further away are treated the same as cells with no ghost near them. Only the
+    # cells of the last field are cleared first, so the cost depends on the ghosts and not on the size of the layout
+    def calculateGhostField(self, state):
+        for i in self.ghostFieldCells:
+            self.ghostDistances[i] = None
+        self.ghostOccupancy = {}
+        self.ghostFieldCells = []
+        frontier = collections.deque()
+        for ghostPosition, scared in api.ghostStates(state):
+            for cell in self.getGhostCells(ghostPosition):
+                i = self.cellIndex.get(cell)
+                if i is None:
+                    continue
+                self.ghostOccupancy[i] = self.ghostOccupancy.get(i, True) and scared == 1
+                if scared != 1 and self.ghostDistances[i] is None: # edible ghosts aren't a danger so nothing spreads from them
+                    self.ghostDistances[i] = 0
+                    self.ghostFieldCells.append(i)
+                    frontier.append(i)
+
+        avoidDistance = self.getAvoidDistance()
+        while frontier:
+            i = frontier.popleft()
+            if self.ghostDistances[i] >= avoidDistance:
+                continue
+            for j in self.transitions[i]:
+                if self.ghostDistances[j] is None:
+                    self.ghostDistances[j] = self.ghostDistances[i] + 1
+                    self.ghostFieldCells.append(j)
+                    frontier.append(j)
+
+    # Function calculateCellRewards works out once per move which cells have a fixed utility (a ghost is in them
+    # or they hold food that isn't near a dangerous ghost) and which cells get the Bellman update during value
+    # iteration. It reads the ghost influence field built by calculateGhostField, so it works for any number of ghosts.
+    # On the first move of a game every cell is worked out. After that only the cells that can have changed are: the
+    # ones whose food has been eaten and the ones in the ghost field of the last run or of this one. The cells whose
+    # fixed utility changed end up in self.changedCells
+    def calculateCellRewards(self, state):
+        previousGhostCells = self.ghostFieldCells + self.ghostOccupancy.keys()
+        self.calculateGhostField(state)
+        if self.eatenCells is None:
+            if self.backend == "numpy":
+                self.fixedMask = np.zeros(len(self.coordinatesOfEachEXField), dtype=bool)
+                self.fixedValues = np.zeros(len(self.coordinatesOfEachEXField), dtype=float)
+                self.calculateFixedArrays(slice(None))
+                if self.incremental:
+                    # prioritized sweeping goes cell by cell, so it works on the fixed utilities as a list
+                    fixedUtilities = self.fixedValues.astype(object)
+                    fixedUtilities[~self.fixedMask] = None
+                    self.fixedUtilities = fixedUtilities.tolist()
+            else:
+                self.fixedUtilities = [self.getFixedUtility(i) for i in range(len(self.coordinatesOfEachEXField))]
+            self.changedCells = None
+        else:
+            cells = sorted(set(self.eatenCells + previousGhostCells + self.ghostFieldCells + self.ghostOccupancy.keys()))
+            self.changedCells = []
+            if self.backend == "numpy":
+                self.calculateFixedArrays(np.array(cells, dtype=int))
+                if self.incremental:
+                    for i in cells:
+                        fixed = float(self.fixedValues[i]) if self.fixedMask[i] else None
+                        if fixed != self.fixedUtilities[i]:
+                            self.fixedUtilities[i] = fixed
+                            self.changedCells.append(i)
+            else:
+                for i in cells:
+                    fixed = self.getFixedUtility(i)
+                    if fixed != self.fixedUtilities[i]:
+                        self.fixedUtilities[i] = fixed
+                        self.changedCells.append(i)
+        self.eatenCells = []
+        if self.compressCorridors:
+            self.calculateCorridorEntries()
+
+    # Function calculateFixedArrays is calculateCellRewards for the numpy backend: the same fixed utilities as
+    # getFixedUtility for the given cells (an index array, or a slice for all of them), kept in two arrays (fixedMask
+    # picks out the cells whose utility is pinned to fixedValues). The food cells are pinned to foodCost straight from
+    # the cell-type codes of the map, then only the few cells near a dangerous ghost or with a ghost in them are changed
+    def calculateFixedArrays(self, cells):
+        food = np.frombuffer(self.map.cells, dtype=np.uint8)[self.mapPositions[cells]] == Grid.FOOD
+        self.fixedMask[cells] = food
+        self.fixedValues[cells] = np.where(food, self.foodCost, 0.0)
+        self.fixedMask[self.ghostFieldCells] = False # food near a dangerous ghost gets the Bellman update
+        self.fixedValues[self.ghostFieldCells] = 0.0
+        for i, edible in self.ghostOccupancy.items():
+            self.fixedMask[i] = True
+            self.fixedValues[i] = self.edibleGhostCost if edible else self.ghostCost
+
+    # Function getFixedUtility gives the utility a cell is pinned to this move, or None if it gets the Bellman update
+    def getFixedUtility(self, i):
+        x, y = self.coordinatesOfEachEXField[i]
+        if i in self.ghostOccupancy: # theres a ghost within the same cell as a food or empty cell
+            if self.ghostOccupancy[i]:
+                # if every ghost in it is edible then assign self.edibleGhostCost cost to the state's utility regardless if the same cell has a food or if it's empty
+                return self.edibleGhostCost
+            # else assign the normal ghost cost utility to the state
+            return self.ghostCost
+        if self.map.getValue(x, y) == "*" : # If the value of the current state is a food
+            if self.ghostDistances[i] is not None :
+                return None # the calculated utility is used because a ghost is near the food
+            return self.foodCost # else the normal food cost is used
+        return None # otherwise if it is an empty cell then the calculated utility is used
+
+    # Function calculateFoodDistances works out the maze distance from every cell to the nearest food with a breadth
+    # first search started from all the food at once (once per game, removeFoodDistance keeps it up to date)
+    def calculateFoodDistances(self):
+        self.foodDistances = [None] * len(self.coordinatesOfEachEXField)
+        frontier = collections.deque()
+        for cell in self.foodInMap:
+            i = self.cellIndex[cell]
+            self.foodDistances[i] = 0
+            frontier.append(i)
+        while frontier:
+            i = frontier.popleft()
+            for j in self.transitions[i]:
+                if self.foodDistances[j] is None:
+                    self.foodDistances[j] = self.foodDistances[i] + 1
+                    frontier.append(j)
+
+    # Function removeFoodDistance updates the food distances once the food in cell f has been eaten. Only the cells
+    # whose every shortest path to food ended in f change, so those are found first (going out from f one distance at
+    # a time) and then filled in again from the cells around them. This keeps the work to the part of the maze that
+    # was closest to f, which is small while there is plenty of food left
+    def removeFoodDistance(self, f):
+        distances = self.foodDistances
+        affected = set([f])
+        order = [f]
+        frontier = collections.deque([f])
+        while frontier:
+            i = frontier.popleft()
+            for j in self.transitions[i]:
+                if j in affected or distances[j] != distances[i] + 1:
+                    continue
+                # j keeps its distance if a neighbour that isn't affected is one move closer to food
+                if all(k in affected or distances[k] != distances[j] - 1 for k in self.transitions[j]):
+                    affected.add(j)
+                    order.append(j)
+                    frontier.append(j)
+
+        for i in order:
+            distances[i] = None
+        queue = []
+        for i in order:
+            reachable = [distances[k] + 1 for k in self.transitions[i] if k not in affected and distances[k] is not None]
+            if reachable:
+                heapq.heappush(queue, (min(reachable), i))
+        while queue:
+            distance, i = heapq.heappop(queue)
+            if distances[i] is not None and distances[i] <= distance:
+                continue
+            distances[i] = distance
+            for j in self.transitions[i]:
+                if j in affected and (distances[j] is None or distances[j] > distance + 1):
+                    heapq.heappush(queue, (distance + 1, j))
+
+    # Function getFoodPotential gives the utility of heading straight for the nearest food from a cell (with the
+    # per-step reward and discount of getCorridorStep), or of never reaching any if there is none left in reach
+    def getFoodPotential(self, i):
+        stepReward, stepDiscount = self.getCorridorStep()
+        if self.foodDistances[i] is None:
+            return stepReward / (1 - stepDiscount)
+        discount = stepDiscount ** self.foodDistances[i]
+        return stepReward * (1 - discount) / (1 - stepDiscount) + discount * self.foodCost
+
+    # Function getHorizonWindow returns the cells within self.horizon moves of a cell, in order of their distance from
+    # it, together with that distance
+    def getHorizonWindow(self, start):
+        window = [start]
+        distances = {start: 0}
+        position = 0
+        while position < len(window):
+            i = window[position]
+            position += 1
+            if distances[i] == self.horizon:
+                continue
+            for j in self.transitions[i]:
+                if j not in distances:
+                    distances[j] = distances[i] + 1
+                    window.append(j)
+        return window, distances
+
+    # Function calculateHorizonWindow sets up the sub-problem of a receding horizon solve: the window of cells around
+    # pacman with their successors as indices into the window, the utility of each window cell that is pinned this
+    # move (the cells at the edge of the window are pinned to their food potential unless food or a ghost pins them
+    # already) and the utilities the others start from, which are the ones earlier moves left them with
+    def calculateHorizonWindow(self, state):
+        self.calculateGhostField(state)
+        window, distances = self.getHorizonWindow(self.cellIndex[api.whereAmI(state)])
+        localIndex = dict((window[k], k) for k in range(len(window)))
+        self.windowCells = window
+        self.windowTransitions = []
+        self.windowFixedUtilities = []
+        for k in range(len(window)):
+            i = window[k]
+            self.windowTransitions.append(tuple(localIndex.get(j, k) for j in self.transitions[i]))
+            fixed = self.getFixedUtility(i)
+            if fixed is None and distances[i] == self.horizon:
+                fixed = self.getFoodPotential(i)
+            self.windowFixedUtilities.append(fixed)
+        self.windowUtilities = [self.expectedUtilities[window[k]] if self.windowFixedUtilities[k] is None else self.windowFixedUtilities[k]
+                                for k in range(len(window))]
+
+    # Function sweepHorizonWindow applies the Bellman update to the cells of the window (a Jacobi sweep for the value
+    # solver, in place for gaussSeidel) and returns the max change of a utility
+    def sweepHorizonWindow(self):
+        utilities = self.windowUtilities
+        if self.solver == "gaussSeidel":
+            nextUtilities = utilities
+        else:
+            nextUtilities = list(utilities)
+        residual = 0
+        for k in range(len(utilities)):
+            if self.windowFixedUtilities[k] is not None:
+                continue
+            north, west, south, east = self.windowTransitions[k]
+            newValue = self.emptyTileCost + (self.gamma * max(getActionValues(utilities, north, west, south, east)))
+            residual = max(residual, abs(newValue - utilities[k]))
+            nextUtilities[k] = newValue
+        self.windowUtilities = nextUtilities
+        return residual
+
+    # Function runHorizonIteration is value iteration on the window around pacman (receding horizon mode), with the
+    # usual stopping rule. The results are written back into self.expectedUtilities, where the next windows start from
+    def runHorizonIteration(self, state):
+        self.calculateHorizonWindow(state)
+        while self.keepSweeping(self.iterationCount):
+            self.finalResidual = self.sweepHorizonWindow()
+            self.iterationCount += 1
+            if self.finalResidual <= self.residualThreshold():
+                break
+        for k in range(len(self.windowCells)):
+            self.expectedUtilities[self.windowCells[k]] = self.windowUtilities[k]
+
     #Function calculateNextValueIteration retrieves next iteration values of expected utility
     def calculateNextIterationValues(self,state):
         nextExpectedUtilities = [] # This array will store the return value of all next iteration expected utility values
+        utilities = self.expectedUtilities
+
+        for i in range(len(utilities)): # For loop to iterate through all current expected utility values
+            if self.fixedUtilities[i] is not None: # food and ghost cells keep the utility set by calculateCellRewards
+                nextExpectedUtilities.append(self.fixedUtilities[i])
+                continue
+
+            # indices of the cells to the north, west, south and east of the current state (the state itself if that side is a wall)
+            north, west, south, east = self.transitions[i]
+
+            # leftValue, rightValue, downValue and upValue calculate the utility of going in that direction from this current location for
+            # example if the state was (3,1) then leftValue would be 0.8U(2,1) + 0.1U(3,1) + 0.1U(3,2) assuming theres a wall at (3,0)
+            upValue, leftValue, downValue, rightValue = getActionValues(utilities, north, west, south, east)
 
-        for i in range(len(self.expectedUtilities)): # For loop to iterate through all current expected utility values
-            # For the current expected utility value and it's location; extract the map value and the location of a cell to the west
-            westValue = self.map.getValue(self.coordinatesOfEachEXField[i][0]-1,self.coordinatesOfEachEXField[i][1]) 
-            westValueCoordinates = (self.coordinatesOfEachEXField[i][0]-1,self.coordinatesOfEachEXField[i][1])
-            # For the current expected utility value and it's location; extract the map value and the location of a cell to the east
-            eastValue = self.map.getValue(self.coordinatesOfEachEXField[i][0]+1,self.coordinatesOfEachEXField[i][1])
-            eastValueCoordinates = (self.coordinatesOfEachEXField[i][0]+1,self.coordinatesOfEachEXField[i][1])
-            # For the current expected utility value and it's location; extract the map value and the location of a cell to the south
-            southValue = self.map.getValue(self.coordinatesOfEachEXField[i][0],self.coordinatesOfEachEXField[i][1]-1)
-            southValueCoordinates= (self.coordinatesOfEachEXField[i][0],self.coordinatesOfEachEXField[i][1]-1)
-            # For the current expected utility value and it's location; extract the map value and the location of a cell to the north
-            northValue = self.map.getValue(self.coordinatesOfEachEXField[i][0],self.coordinatesOfEachEXField[i][1]+1)
-            northValueCoordinates = (self.coordinatesOfEachEXField[i][0],self.coordinatesOfEachEXField[i][1]+1)
-
-            # leftCalc1, leftCalc2 and leftCalc3 calculate the utility of going left from this current location for example if the state was (3,1) 
-            # then leftCalc1 variable will be storing the value of: 0.8U(2,1), leftCalc2 would be storing the value of: 0.1U(3,1) assuming theres 
-            # a wall at (3,0) and the same procedure is carried out for (Right), (Down) and (Up) to gather utility values for all directions
-
-            leftCalc1 = 0.8 * MDPAgent.getCostFactor(self,state,westValue,"West", self.expectedUtilities[i], westValueCoordinates, eastValueCoordinates, southValueCoordinates, northValueCoordinates)
-            leftCalc2 = 0.1 * MDPAgent.getCostFactor(self,state,southValue,"South", self.expectedUtilities[i], westValueCoordinates, eastValueCoordinates, southValueCoordinates, northValueCoordinates)
-            leftCalc3 = 0.1 * MDPAgent.getCostFactor(self,state,northValue,"North", self.expectedUtilities[i], westValueCoordinates, eastValueCoordinates, southValueCoordinates, northValueCoordinates)
-
-            rightCalc1 = 0.8 * MDPAgent.getCostFactor(self,state,eastValue,"East", self.expectedUtilities[i], westValueCoordinates, eastValueCoordinates, southValueCoordinates, northValueCoordinates)
-            rightCalc2 = 0.1 * MDPAgent.getCostFactor(self,state,northValue,"North", self.expectedUtilities[i], westValueCoordinates, eastValueCoordinates, southValueCoordinates, northValueCoordinates)
-            rightCalc3 = 0.1 * MDPAgent.getCostFactor(self,state,southValue,"South", self.expectedUtilities[i], westValueCoordinates, eastValueCoordinates, southValueCoordinates, northValueCoordinates)
-
-            downCalc1 = 0.8 * MDPAgent.getCostFactor(self,state,southValue,"South", self.expectedUtilities[i], westValueCoordinates, eastValueCoordinates, southValueCoordinates, northValueCoordinates)
-            downCalc2 = 0.1 * MDPAgent.getCostFactor(self,state,eastValue,"East", self.expectedUtilities[i], westValueCoordinates, eastValueCoordinates, southValueCoordinates, northValueCoordinates)
-            downCalc3 = 0.1 * MDPAgent.getCostFactor(self,state,westValue,"West", self.expectedUtilities[i], westValueCoordinates, eastValueCoordinates, southValueCoordinates, northValueCoordinates)
-
-            upCalc1 = 0.8 * MDPAgent.getCostFactor(self,state,northValue,"North", self.expectedUtilities[i], westValueCoordinates, eastValueCoordinates, southValueCoordinates, northValueCoordinates)
-            upCalc2 = 0.1 * MDPAgent.getCostFactor(self,state,westValue,"West", self.expectedUtilities[i], westValueCoordinates, eastValueCoordinates, southValueCoordinates, northValueCoordinates)
-            upCalc3 = 0.1 * MDPAgent.getCostFactor(self,state,eastValue,"East", self.expectedUtilities[i], westValueCoordinates, eastValueCoordinates, southValueCoordinates, northValueCoordinates)
-
-            # All gathered values are added and stored inside potentialUtilityValues array
-            potentialUtilityValues = [(upCalc1+upCalc2+upCalc3), (leftCalc1+leftCalc2+leftCalc3), (downCalc1+downCalc2+downCalc3), (rightCalc1+rightCalc2+rightCalc3)] 
             # Max utility value is extracted and stored in a variable
-            maxUtilityValue = max(potentialUtilityValues)           
-            
+            maxUtilityValue = max(upValue, leftValue, downValue, rightValue)
+
             utilityOfTheState = self.emptyTileCost + (self.gamma * maxUtilityValue) # Bellman update is applied [Ui+1(s) <--- R(s) + y max...] to the current state
-            #utilityOfTheState = round(utilityOfTheState,3) # Value is rounded to three decimal places
-           
-            ghostInfo = api.ghostStates(state) # Retrieving ghost information
-            numOfGhosts = len(ghostInfo) # Number of ghosts
-
-            if self.map.getValue(self.coordinatesOfEachEXField[i][0], self.coordinatesOfEachEXField[i][1]) == "*" or self.map.getValue(self.coordinatesOfEachEXField[i][0], self.coordinatesOfEachEXField[i][1]) == " ":
-                # IF logic to establish if theres a ghost within the same cell of a food or empty cell (comparing ghost coordinates to the current state coordinates)
-                if (ghostInfo[0][0][0],ghostInfo[0][0][1]) == (self.coordinatesOfEachEXField[i][0], self.coordinatesOfEachEXField[i][1]) or (ghostInfo[numOfGhosts-1][0][0],ghostInfo[numOfGhosts-1][0][1]) == (self.coordinatesOfEachEXField[i][0], self.coordinatesOfEachEXField[i][1]) :
-                    # if theres a ghost at the current state; checking if it's edible or not
-                    if ghostInfo[0][1] == 1 and ghostInfo[numOfGhosts-1][1] == 1:
-                        # if it's edible then assign self.edibleGhostCost cost to the state's utility regardless if the same cell has a food or if it's empty
-                        nextExpectedUtilities.append(self.edibleGhostCost)
-                    else :
-                        # else assign the normal ghost cost utility to the state
-                        nextExpectedUtilities.append(self.ghostCost)
-                else :  
-                    if numOfGhosts == 2 :
-                        # if the ghosts are not located within the current state; I check all food and empty cells that are within a certain
-                        # distance threshold to the ghost. Below I use a distance formula [(x2 - x1)^2 + (y2 - y1)^2] to determine the distance 
-                        # of the current state to the ghost
-                        distanceToGhost1 = abs(self.coordinatesOfEachEXField[i][0] - ghostInfo[0][0][0])**2 + abs(self.coordinatesOfEachEXField[i][1]- ghostInfo[0][0][1])**2
-                        distanceToGhost2 = abs(self.coordinatesOfEachEXField[i][0] - ghostInfo[1][0][0])**2 + abs(self.coordinatesOfEachEXField[i][1]- ghostInfo[1][0][1])**2
-                    else :
-                        # In the case of there being only one ghost; I set the second ghost distance variable to something will be ignored
-                        distanceToGhost1 = abs(self.coordinatesOfEachEXField[i][0] - ghostInfo[0][0][0])**2 + abs(self.coordinatesOfEachEXField[i][1]- ghostInfo[0][0][1])**2
-                        distanceToGhost2 = 10000
-                    
-                    
-
-                    if self.map.getValue(self.coordinatesOfEachEXField[i][0], self.coordinatesOfEachEXField[i][1]) == "*" :  # If the value of the current state is a food
-                        
-                        # Note I don't square root the distance values because when square rooting there's too much a difference between 1 and 2 blocks for the smallGrid
-                        avoidDistance = 0
-                        # depending on the grid scale; I set the avoid distance smaller if it's below or equal to 7x7 because pacman doesn't have as much space to move around
-                        # in smaller grids to avoid the ghost/ghosts
-                        if self.map.getHeight() <= 7 or self.map.getWidth() <= 7:
-                            avoidDistance = 2.5
-                        else :
-                            avoidDistance = 5.5
-                        
-                        
-                        if distanceToGhost1 <= avoidDistance or distanceToGhost2 <= avoidDistance : 
-                            nextExpectedUtilities.append(utilityOfTheState)  #  assign the calculated utility based on the ghost being next to it  
-                        else : 
-                            nextExpectedUtilities.append(self.foodCost)  # else asign the normal food cost 
-                    else :  
-                        nextExpectedUtilities.append(utilityOfTheState)  # otherwise if it is an empty cell then assign  the calculated utility
+            nextExpectedUtilities.append(utilityOfTheState)
         return nextExpectedUtilities    # return the next iteration of values (when the for loop terminates, all expected utilities iterate)
-    
-    #Function getCostFactor get's a multiplication value based on what is next to pacman [used to workout utilities of (left), (right), (down) and (up)]
-    def getCostFactor(self,state,stateValue, directionOfMove, currentExpectedUtility,  westValCord, eastValCord, southValCord, northValCord):
-
-        multiplicationFactor = 0 # the value that's returned is first set to 0
-
-        if stateValue == "%" : # if the value of the next state is a wall
-            # the multiplication factor is the utility of the same cell where pacman is located because pacman will not move locations if he hits a wall
-            multiplicationFactor = currentExpectedUtility 
-            # if the value of next state empty
-        elif stateValue == " " : 
-            # assign the expected utlity of the state that's empty based on the direction that pacman would be moving    
-            multiplicationFactor = MDPAgent.getNeighbourCost(self,state, directionOfMove, westValCord, eastValCord, southValCord, northValCord)
-            #if the value of next state is a food
-        elif stateValue == "*" :
-            # assign the expected utlity of the state that's a food based on the direction that pacman would be moving
-            multiplicationFactor = MDPAgent.getNeighbourCost(self,state, directionOfMove, westValCord, eastValCord, southValCord, northValCord)
-        return multiplicationFactor
-
-    #Function getNeighbourCost supports the getCostFactor function by returning the expected utility value of a cell based on coordinates 
-    def getNeighbourCost(self,state, neighbourDirection, westValCord, eastValCord, southValCord, northValCord) :
-        neighbourCost = 0 # return value that I first set to 0
-        indexUtilityOfState = 0 # index used to find the expected utility of a state based on location
-
-        if neighbourDirection == "West" : # if the direction of the state is west
-            indexUtilityOfState = self.coordinatesOfEachEXField.index(westValCord) # find index of the west utility state cost
-            neighbourCost = self.expectedUtilities[indexUtilityOfState] # utility value is assigned to the neigbhour expected utility value
-        #same is carried out for the East, South and North locations
-        elif neighbourDirection == "East" :  
-            indexUtilityOfState = self.coordinatesOfEachEXField.index(eastValCord)
-            neighbourCost = self.expectedUtilities[indexUtilityOfState]
-
-        elif neighbourDirection == "South" : 
-            indexUtilityOfState = self.coordinatesOfEachEXField.index(southValCord)       
-            neighbourCost = self.expectedUtilities[indexUtilityOfState] 
-
-        elif neighbourDirection == "North" :  
-            indexUtilityOfState = self.coordinatesOfEachEXField.index(northValCord)         
-            neighbourCost = self.expectedUtilities[indexUtilityOfState] 
-            
-        return neighbourCost
-        
+
+    # Function calculateNextIterationValuesNumpy is the vectorized version of calculateNextIterationValues used by the
+    # numpy backend. The four action values are worked out for every cell at once with the same arithmetic (and so
+    # the same rounding) as the loop above, which means both backends end up with the same utilities and policy
+    def calculateNextIterationValuesNumpy(self):
+        upValues, leftValues, downValues, rightValues = getActionValues(self.expectedUtilities, self.northIndices, self.westIndices,
+                                                                        self.southIndices, self.eastIndices)
+        maxUtilityValues = np.maximum(np.maximum(upValues, leftValues), np.maximum(downValues, rightValues))
+        return np.where(self.fixedMask, self.fixedValues, self.emptyTileCost + (self.gamma * maxUtilityValues))
+
+    # Function calculateCellValue applies the Bellman update to a single cell (same calculation as calculateNextIterationValues)
+    def calculateCellValue(self, i):
+        return self.emptyTileCost + (self.gamma * max(self.calculateActionValues(i)))
+
+    # Function pushSweepCell adds a cell to the prioritized sweeping queue if its Bellman residual is big enough
+    def pushSweepCell(self, i):
+        if self.fixedUtilities[i] is None:
+            residual = abs(self.calculateCellValue(i) - self.expectedUtilities[i])
+            if residual > self.residualThreshold():
+                heapq.heappush(self.sweepQueue, (-residual, i))
+
+    # Function runPrioritizedSweeping is the incremental mode of value iteration. The utilities of the previous move
+    # are kept, the cells whose fixed utility changed since then (food eaten, ghosts moved) are marked dirty and the
+    # change is spread outwards from them, always backing up the cell with the biggest Bellman residual first. On the
+    # first move of a game every cell is dirty. Work is capped at the cost of maxIterations full sweeps (or by the
+    # deadline in anytime mode); anything left in the queue is carried over to the next move
+    def runPrioritizedSweeping(self):
+        utilities = self.expectedUtilities
+        if not self.queueCarriedOver or self.changedCells is None:
+            self.seedSweepQueue()
+        else:
+            for i in self.changedCells:
+                if self.fixedUtilities[i] is not None:
+                    # the utility of the cell is pinned so the cells that read it have to be looked at again
+                    utilities[i] = self.fixedUtilities[i]
+                    for j in self.predecessors[i]:
+                        self.pushSweepCell(j)
+                else:
+                    self.pushSweepCell(i)
+
+        self.backupCount = 0
+        maxBackups = self.maxIterations * len(utilities)
+        while self.sweepQueue and (self.deadline is not None or self.backupCount < maxBackups):
+            # the clock is only read every 64 backups since a single backup is cheap
+            if self.deadline is not None and self.backupCount % 64 == 0 and time.time() >= self.deadline:
+                break
+            negativeResidual, i = heapq.heappop(self.sweepQueue)
+            if self.fixedUtilities[i] is not None: # the cell was pinned after it was queued
+                continue
+            newValue = self.calculateCellValue(i)
+            if abs(newValue - utilities[i]) <= self.residualThreshold(): # stale entry, the cell was already backed up
+                continue
+            utilities[i] = newValue
+            self.backupCount += 1
+            for j in self.predecessors[i]:
+                self.pushSweepCell(j)
+        self.finalResidual = self.calculateMaxResidual()
+        if self.finalResidual is None:
+            # no time left to look at every cell. Every cell whose residual is above residualThreshold is in the queue
+            # with its residual (a cell is queued again whenever a cell it reads changes), so the biggest queued
+            # residual bounds the real one
+            self.finalResidual = max(-self.sweepQueue[0][0] if self.sweepQueue else 0, self.residualThreshold())
+
+    # Function seedSweepQueue starts prioritized sweeping over: every cell is pinned to its fixed utility or queued
+    # with its Bellman residual (registerInitialState does it, so the first move of a game only has the changes to queue)
+    def seedSweepQueue(self):
+        utilities = self.expectedUtilities
+        self.sweepQueue = []
+        for i in range(len(utilities)):
+            if self.fixedUtilities[i] is not None:
+                utilities[i] = self.fixedUtilities[i]
+        for i in range(len(utilities)):
+            self.pushSweepCell(i)
+        self.queueCarriedOver = True
+
+    # Function calculateMaxResidual gives the max-norm Bellman residual of the current utilities (over the cells that
+    # aren't pinned). Incremental mode only backs up the cells it has queued, so this is how it finds out where it got to.
+    # In anytime mode it gives up (returning None) once the deadline has passed, the clock is read every 256 cells
+    def calculateMaxResidual(self):
+        residual = 0
+        for i in range(len(self.expectedUtilities)):
+            if self.deadline is not None and i % 256 == 0 and time.time() >= self.deadline:
+                return None
+            if self.fixedUtilities[i] is None:
+                residual = max(residual, abs(self.calculateCellValue(i) - self.expectedUtilities[i]))
+        return residual
+
+    # Function getCorridorStep gives the reward and discount of one step along a corridor. Going along a straight
+    # corridor pacman gets to the next cell with probability 0.8 and bumps into a wall (staying put) otherwise, so
+    # U = R + gamma * (0.8 * U(next) + 0.2 * U), which is U = stepReward + stepDiscount * U(next) with these values
+    def getCorridorStep(self):
+        stay = 1 - 0.2 * self.gamma
+        return self.emptyTileCost / stay, 0.8 * self.gamma / stay
+
+    # Function getHeadingValue gives the utility of a corridor cell for a pacman that keeps going one way along the
+    # corridor (step 1 towards its end node, -1 towards its start node) as (constant, factor, node), meaning
+    # constant + factor * U(node). The rewards of the cells on the way are added up and discounted by how far they
+    # are; the first pinned cell (food or a ghost) ends the walk, in which case factor is 0
+    def getHeadingValue(self, corridor, position, step):
+        cells, startNode, endNode = self.corridors[corridor]
+        node = endNode if step > 0 else startNode
+        stepReward, stepDiscount = self.corridorStep
+        constant = 0.0
+        factor = 1.0
+        while 0 <= position < len(cells):
+            if self.fixedUtilities[cells[position]] is not None:
+                return constant + factor * self.fixedUtilities[cells[position]], 0.0, node
+            constant += factor * stepReward
+            factor *= stepDiscount
+            position += step
+        return constant, factor, node
+
+    # Function calculateCorridorEntries works out once per move the utility of the first cell of each corridor for a
+    # pacman that goes in at either end and keeps going (it depends on the food and ghosts along the corridor). Only the
+    # corridors with a cell whose fixed utility changed are worked out again, unless calculateCellRewards set up every cell
+    def calculateCorridorEntries(self):
+        self.corridorStep = self.getCorridorStep()
+        if self.changedCells is None:
+            corridors = range(len(self.corridors))
+            self.corridorEntries = [None] * len(self.corridors)
+        else:
+            corridors = set(self.cellCorridor[i][0] for i in self.changedCells if self.cellCorridor[i] is not None)
+        for corridor in corridors:
+            cells = self.corridors[corridor][0]
+            self.corridorEntries[corridor] = (self.getHeadingValue(corridor, 0, 1), self.getHeadingValue(corridor, len(cells) - 1, -1))
+
+    # Function getStayValue gives the utility of a corridor cell for a pacman that heads for neither end: going back and
+    # forth with an open neighbour in the corridor is worth the step reward forever, and a cell whose neighbours are both
+    # pinned or nodes can instead keep moving into a wall (0.8 stay, 0.1 to each neighbour). A cell with an open
+    # neighbour never does better by moving into a wall, so only one of the two is worked out
+    def getStayValue(self, corridor, position, utilities):
+        cells, startNode, endNode = self.corridors[corridor]
+        stepReward, stepDiscount = self.corridorStep
+        neighbourValues = []
+        for neighbour, node in ((position - 1, startNode), (position + 1, endNode)):
+            if not 0 <= neighbour < len(cells):
+                neighbourValues.append(utilities[node])
+            elif self.fixedUtilities[cells[neighbour]] is None:
+                return stepReward / (1 - stepDiscount)
+            else:
+                neighbourValues.append(self.fixedUtilities[cells[neighbour]])
+        return (self.emptyTileCost + 0.1 * self.gamma * sum(neighbourValues)) / (1 - 0.8 * self.gamma)
+
+    # Function getExitValue gives the utility of the cell an exit of a node leads to: that of a node, or for a corridor
+    # the best of going on through it, turning back to the node and staying (see getStayValue)
+    def getExitValue(self, node, exit, utilities):
+        corridor, target = exit
+        if corridor is None:
+            return utilities[target]
+        cells = self.corridors[corridor][0]
+        firstCell = cells[0] if target else cells[-1]
+        if self.fixedUtilities[firstCell] is not None:
+            return self.fixedUtilities[firstCell]
+        constant, factor, farNode = self.corridorEntries[corridor][0 if target else 1]
+        stepReward, stepDiscount = self.corridorStep
+        return max(constant + factor * utilities[farNode], stepReward + stepDiscount * utilities[node],
+                   self.getStayValue(corridor, 0 if target else len(cells) - 1, utilities))
+
+    # Function calculateNodeValue applies the Bellman update to a node of the junction graph (the same update as
+    # calculateCellValue, with the utilities of the neighbouring cells worked out from the exits of the node)
+    def calculateNodeValue(self, node, utilities):
+        exitValues = [self.getExitValue(node, exit, utilities) for exit in self.nodeExits[node]]
+        return self.emptyTileCost + (self.gamma * max(getActionValues(exitValues, 0, 1, 2, 3)))
+
+    # Function calculateNextNodeValues is one Jacobi sweep over the nodes of the junction graph
+    def calculateNextNodeValues(self):
+        nextNodeUtilities = []
+        for node in range(len(self.graphNodes)):
+            fixed = self.fixedUtilities[self.graphNodes[node]]
+            nextNodeUtilities.append(fixed if fixed is not None else self.calculateNodeValue(node, self.nodeUtilities))
+        return nextNodeUtilities
+
+    # Function runCorridorIteration is value iteration on the junction graph (Jacobi sweeps for the value solver,
+    # in place for gaussSeidel) with the same stopping rule as the other solvers
+    def runCorridorIteration(self):
+        while self.keepSweeping(self.iterationCount):
+            if self.solver == "gaussSeidel":
+                utilities = self.nodeUtilities
+                self.finalResidual = 0
+                for node in range(len(self.graphNodes)):
+                    fixed = self.fixedUtilities[self.graphNodes[node]]
+                    newValue = fixed if fixed is not None else self.calculateNodeValue(node, utilities)
+                    self.finalResidual = max(self.finalResidual, abs(newValue - utilities[node]))
+                    utilities[node] = newValue
+            else:
+                previousNodeUtilities = self.nodeUtilities
+                self.nodeUtilities = self.calculateNextNodeValues()
+                self.finalResidual = max([abs(new - old) for new, old in zip(self.nodeUtilities, previousNodeUtilities)] + [0])
+            self.iterationCount += 1
+            if self.finalResidual <= self.residualThreshold():
+                break
+
+    # Function getCellUtility works out the utility of any open cell from the node utilities: a node has its own, a
+    # pinned cell its fixed utility and a corridor cell the best of heading to either end of its corridor and staying
+    def getCellUtility(self, i):
+        if self.nodeOf[i] is not None:
+            return self.nodeUtilities[self.nodeOf[i]]
+        if self.fixedUtilities[i] is not None:
+            return self.fixedUtilities[i]
+        corridor, position = self.cellCorridor[i]
+        forwardConstant, forwardFactor, endNode = self.getHeadingValue(corridor, position, 1)
+        backwardConstant, backwardFactor, startNode = self.getHeadingValue(corridor, position, -1)
+        return max(forwardConstant + forwardFactor * self.nodeUtilities[endNode],
+                   backwardConstant + backwardFactor * self.nodeUtilities[startNode],
+                   self.getStayValue(corridor, position, self.nodeUtilities))
+
+    # Function keepSweeping decides if a solve goes on for another step. In anytime mode it goes on until the deadline
+    # of the move, otherwise until count (sweeps, or policy improvement steps) reaches maxIterations
+    def keepSweeping(self, count):
+        if self.deadline is not None:
+            # a step is only started if one as long as the last one still ends before the deadline (the first one of
+            # a move is started whenever there is time left)
+            now = time.time()
+            stepTime = now - self.stepStart if count > 0 else 0
+            self.stepStart = now
+            return now + stepTime < self.deadline
+        return count < self.maxIterations
+
+    # Function residualThreshold gives the max-norm Bellman residual at which a solve stops (the usual
+    # epsilon * (1 - gamma) / gamma bound, so the utilities end up within epsilon of the optimal ones)
+    def residualThreshold(self):
+        return self.epsilon * (1 - self.gamma) / self.gamma
+
+    # Function applyFixedUtilities pins the food and ghost cells to their utility for this move. The in-place solvers
+    # need this before their first sweep (the Jacobi sweep does it as part of the update). They never change a pinned
+    # cell, so after registerInitialState has pinned every cell only the ones calculateCellRewards changed are left
+    def applyFixedUtilities(self):
+        if self.backend == "numpy":
+            self.expectedUtilities[self.fixedMask] = self.fixedValues[self.fixedMask]
+        else:
+            for i in range(len(self.fixedUtilities)) if self.changedCells is None else self.changedCells:
+                if self.fixedUtilities[i] is not None:
+                    self.expectedUtilities[i] = self.fixedUtilities[i]
+
+    # Function calculateActionValues returns the (Up, Left, Down, Right) action values of a cell
+    def calculateActionValues(self, i):
+        north, west, south, east = self.transitions[i]
+        return getActionValues(self.expectedUtilities, north, west, south, east)
+
+    # Function calculateActionValuesNumpy returns the (Up, Left, Down, Right) action values of the given cells as arrays
+    def calculateActionValuesNumpy(self, cells):
+        return getActionValues(self.expectedUtilities, self.northIndices[cells], self.westIndices[cells],
+                               self.southIndices[cells], self.eastIndices[cells])
+
+    # Function runInPlaceSweep updates the utilities in place, red cells first and then black cells ((x + y) even and
+    # odd). Neighbours always have opposite colours, so this is a Gauss-Seidel sweep that the numpy backend can do
+    # as two vectorized steps and both backends give the same values. With a policy (one action index per cell) the
+    # sweep evaluates that policy, otherwise it applies the Bellman update. Returns the max change of a utility
+    def runInPlaceSweep(self, policy=None):
+        utilities = self.expectedUtilities
+        residual = 0
+        for cells in self.sweepColours:
+            if self.backend == "numpy":
+                cells = cells[~self.fixedMask[cells]]
+                actionValues = self.calculateActionValuesNumpy(cells)
+                if policy is None:
+                    bestValues = np.maximum(np.maximum(actionValues[0], actionValues[1]), np.maximum(actionValues[2], actionValues[3]))
+                else:
+                    bestValues = np.choose(policy[cells], actionValues)
+                newValues = self.emptyTileCost + (self.gamma * bestValues)
+                if len(cells):
+                    residual = max(residual, np.max(np.abs(newValues - utilities[cells])))
+                utilities[cells] = newValues
+            else:
+                for i in cells:
+                    if self.fixedUtilities[i] is not None:
+                        continue
+                    actionValues = self.calculateActionValues(i)
+                    if policy is None:
+                        newValue = self.emptyTileCost + (self.gamma * max(actionValues))
+                    else:
+                        newValue = self.emptyTileCost + (self.gamma * actionValues[policy[i]])
+                    residual = max(residual, abs(newValue - utilities[i]))
+                    utilities[i] = newValue
+        return residual
+
+    # Function improvePolicy applies one Bellman update to every cell (a full sweep) and returns the greedy policy
+    # (index of the best of the Up, Left, Down, Right actions for each cell) together with the Bellman residual
+    def improvePolicy(self):
+        if self.backend == "numpy":
+            actionValues = np.array(self.calculateActionValuesNumpy(slice(None)))
+            policy = np.argmax(actionValues, axis=0)
+            newValues = np.where(self.fixedMask, self.fixedValues, self.emptyTileCost + (self.gamma * np.max(actionValues, axis=0)))
+            residual = np.max(np.abs(newValues - self.expectedUtilities)) if len(newValues) else 0
+            self.expectedUtilities = newValues
+        else:
+            policy = []
+            newValues = []
+            residual = 0
+            for i in range(len(self.expectedUtilities)):
+                actionValues = self.calculateActionValues(i)
+                bestAction = actionValues.index(max(actionValues))
+                policy.append(bestAction)
+                if self.fixedUtilities[i] is not None:
+                    newValues.append(self.fixedUtilities[i])
+                else:
+                    newValues.append(self.emptyTileCost + (self.gamma * actionValues[bestAction]))
+                residual = max(residual, abs(newValues[i] - self.expectedUtilities[i]))
+            self.expectedUtilities = newValues
+        return policy, residual
+
+    # Function runValueIteration is the Jacobi value iteration loop, it keeps going until the Bellman residual
+    # drops to residualThreshold or the number of sweeps reaches maxIterations (the deadline in anytime mode)
+    def runValueIteration(self, state):
+        utilityChangeCheck = [] # Used to store the expected utilities of a previous iteration
+        while self.keepSweeping(self.iterationCount) :
+            utilityChangeCheck = self.expectedUtilities
+            if self.backend == "numpy":
+                self.expectedUtilities = self.calculateNextIterationValuesNumpy()
+                self.finalResidual = np.max(np.abs(self.expectedUtilities - utilityChangeCheck)) if len(utilityChangeCheck) else 0
+            else:
+                self.expectedUtilities = MDPAgent.calculateNextIterationValues(self,state)  # calling calculateNextIterationValues function to get next iteration of values
+                self.finalResidual = max([abs(new - old) for new, old in zip(self.expectedUtilities, utilityChangeCheck)] + [0])
+            self.iterationCount += 1 # iteration the iteration count
+            if self.finalResidual <= self.residualThreshold(): # stop once the utilities have converged to avoid redundant sweeps
+                break
+
+    # Function runTiledValueIteration is the Jacobi value iteration loop of runValueIteration run by the workers of
+    # the tiled solver, with the same stopping rule, so it ends with the same utilities after the same number of sweeps
+    def runTiledValueIteration(self):
+        self.loadTiledSolver()
+        source = 0
+        while self.keepSweeping(self.iterationCount):
+            self.finalResidual = self.tiledSolver.sweep(source, self.emptyTileCost, self.gamma, self.iterationCount == 0)
+            source = 1 - source
+            self.iterationCount += 1
+            if self.finalResidual <= self.residualThreshold():
+                break
+        self.expectedUtilities = self.tiledSolver.getUtilities(source)
+
+    # Function loadTiledSolver puts the fixed utilities of this move and the current utilities in the shared memory of
+    # the tiled solver, ready for its first sweep
+    def loadTiledSolver(self):
+        if self.backend == "numpy":
+            self.tiledSolver.setFixedArrays(self.fixedMask, self.fixedValues)
+        else:
+            self.tiledSolver.setFixedUtilities(self.fixedUtilities)
+        self.tiledSolver.setUtilities(0, self.expectedUtilities)
+
+    # Function runGaussSeidel is value iteration with in-place sweeps, newer values are used as soon as they are known
+    def runGaussSeidel(self):
+        self.applyFixedUtilities()
+        while self.keepSweeping(self.iterationCount):
+            self.finalResidual = self.runInPlaceSweep()
+            self.iterationCount += 1
+            if self.finalResidual <= self.residualThreshold():
+                break
+
+    # Function runPolicyIteration alternates policy improvement with policy evaluation. Policy iteration ("policy")
+    # evaluates each policy until its utilities converge, modified policy iteration ("modifiedPolicy") only runs
+    # evaluationSweeps sweeps of evaluation. It stops when the Bellman residual is small enough, or when the policy is
+    # stable after an evaluation that converged (with only a few evaluation sweeps a stable policy doesn't mean the
+    # utilities have converged, so modified policy iteration mostly stops on the residual)
+    def runPolicyIteration(self):
+        self.applyFixedUtilities()
+        if self.solver == "policy":
+            evaluationSweeps = 10 * self.maxIterations
+        else:
+            evaluationSweeps = self.evaluationSweeps
+        policy = None
+        evaluated = False # whether the evaluation of policy got its residual down to residualThreshold
+        improvements = 0
+        while self.keepSweeping(improvements):
+            newPolicy, self.finalResidual = self.improvePolicy()
+            self.iterationCount += 1
+            improvements += 1
+            if self.finalResidual <= self.residualThreshold():
+                break
+            if evaluated and list(newPolicy) == list(policy):
+                break
+            policy = newPolicy
+            evaluated = False
+            for sweep in range(evaluationSweeps):
+                if self.deadline is not None and time.time() >= self.deadline:
+                    break
+                evaluationResidual = self.runInPlaceSweep(policy)
+                self.iterationCount += 1
+                if evaluationResidual <= self.residualThreshold():
+                    evaluated = True
+                    break
+
+    # Function solve runs the chosen solver for this move, self.iterationCount ends up with the number of sweeps used
+    def solve(self, state):
+        if self.horizon is not None:
+            self.runHorizonIteration(state)
+        elif self.compressCorridors:
+            self.runCorridorIteration()
+        elif self.solver == "gaussSeidel":
+            self.runGaussSeidel()
+        elif self.solver in ("policy", "modifiedPolicy"):
+            self.runPolicyIteration()
+        elif self.solver == "parallel":
+            self.runTiledValueIteration()
+        else:
+            self.runValueIteration(state)
+
+    # Function addTelemetryHook registers a callable that gets every telemetry record (a dict)
+    def addTelemetryHook(self, hook):
+        self.telemetryHooks.append(hook)
+
+    def emitTelemetry(self, record):
+        for hook in self.telemetryHooks:
+            hook(record)
+
+    # Function recordMove sends the telemetry record of a move: how long the map update, the solve and the action
+    # selection took, how much work the solve did and the state of the caches
+    def recordMove(self, moveStart, solveStart, selectionStart, memoHit):
+        moveEnd = time.time()
+        self.emitTelemetry({"event": "move",
+                            "game": self.gameCount,
+                            "move": self.moveCount,
+                            "backend": self.backend,
+                            "solver": "incremental" if self.incremental else self.solver,
+                            "mapUpdateMs": (solveStart - moveStart) * 1000,
+                            "solveMs": (selectionStart - solveStart) * 1000,
+                            "actionSelectionMs": (moveEnd - selectionStart) * 1000,
+                            "totalMs": (moveEnd - moveStart) * 1000,
+                            "sweeps": 0 if memoHit else self.iterationCount,
+                            "backups": 0 if memoHit else self.backupCount,
+                            "finalResidual": None if memoHit else float(self.finalResidual),
+                            "converged": True if memoHit else bool(self.converged),
+                            "preparationOverBudget": self.preparationOverBudget,
+                            "memoHit": memoHit,
+                            "memoHits": self.situationMemo.hits,
+                            "memoMisses": self.situationMemo.misses,
+                            "memoBytes": self.situationMemo.usedBytes,
+                            "layoutCacheHits": self.layoutCache.hits,
+                            "layoutCacheMisses": self.layoutCache.misses,
+                            "layoutCacheEntries": len(self.layoutCache.entries)})
+
+    # Function updateFoodBits clears the bits of the food eaten this move in the food bitset of the situation key (food
+    # only ever goes during a game, so the bitset is built once and then kept up to date from what updateFoodInMap returns)
+    def updateFoodBits(self, eatenFood):
+        if self.foodBits is None or not eatenFood:
+            return
+        for cell in eatenFood:
+            i = self.cellIndex[cell]
+            self.foodBits[i >> 3] &= 0xFF ^ (1 << (i & 7))
+        self.foodDigest = None
+
+    # Function getSituationKey hashes the current situation for the situation memo: the layout, the food that is
+    # left (as a bitset over the cell indices) and the cells and edible state of the ghosts. The hash of the layout
+    # and the food is kept between moves and only worked out again after food has been eaten
+    def getSituationKey(self, state):
+        if self.foodDigest is None:
+            if self.foodBits is None:
+                self.foodBits = bytearray((len(self.coordinatesOfEachEXField) + 7) // 8)
+                for cell in self.foodInMap:
+                    i = self.cellIndex[cell]
+                    self.foodBits[i >> 3] |= 1 << (i & 7)
+            self.foodDigest = hashlib.sha1(self.layoutFingerprint)
+            self.foodDigest.update(bytes(self.foodBits))
+        digest = self.foodDigest.copy()
+        for ghostPosition, scared in sorted(api.ghostStates(state)):
+            digest.update("%r,%r,%d;" % (ghostPosition[0], ghostPosition[1], scared == 1))
+        return digest.digest()
+
     def getAction(self, state):
+        instrumented = bool(self.telemetryHooks) # timings are only taken when something listens for them
+        if instrumented:
+            moveStart = time.time()
+        self.moveCount += 1
+        if self.timeBudget is not None:
+            self.deadline = time.time() + self.timeBudget
         #Update Map and display every state
-        self.updateFoodInMap(state)
+        eatenFood = self.updateFoodInMap(state)
+        self.updateFoodBits(eatenFood)
+        if self.eatenCells is not None:
+            self.eatenCells.extend(self.cellIndex[cell] for cell in eatenFood)
+        if self.horizon is not None:
+            for cell in eatenFood:
+                self.removeFoodDistance(self.cellIndex[cell])
         # self.map.prettyDisplay() displaying the map in console      
         # Remove STOP as a legal action as it will not be a necessary action at any state during the game
         legal = api.legalActions(state)
         pacman = api.whereAmI(state)
         if Directions.STOP in legal:
             legal.remove(Directions.STOP)
-        print
+        if not self.quiet:
+            print
         #print ("Expected Utilities for all states:", self.expectedUtilities)
         #print ("Coordinates of expected Utilities for all states:", self.coordinatesOfEachEXField)
        
+        if instrumented:
+            solveStart = time.time()
         self.iterationCount = 0
-        utilityChangeCheck = [] # Used to store the expected utilities of a previous iteration
-        
-        while (self.iterationCount < 30) : # while loop to keep iterating the values until the values in self.expectedUtilities no longer change or if the number of iterations reaches 50
-            utilityChangeCheck = self.expectedUtilities
-            self.expectedUtilities = MDPAgent.calculateNextIterationValues(self,state)  # calling calculateNextIterationValues function to get next iteration of values
-            self.iterationCount += 1 # iteration the iteration count
-            if(self.expectedUtilities == utilityChangeCheck): # added a threshold to stop iterating at a certain threshold to speed up the performance
-                break
+        situationKey = None
+        memoUtilities = None
+        if self.situationMemo.maxBytes > 0 and self.horizon is None: # a horizon solve also depends on where pacman is
+            situationKey = self.getSituationKey(state)
+            memoUtilities = self.situationMemo.lookup(situationKey)
 
-        print ("number of iterations carried out:", self.iterationCount)  
-        
+        if memoUtilities is not None:
+            # this situation has been solved before so its utilities are reused. The rewards are still worked out, the
+            # next move updates them from these ones (and the cells next to pacman come from them with compressCorridors).
+            # The stored utilities have converged for these rewards, so incremental mode goes on from them with nothing queued
+            self.calculateCellRewards(state)
+            if self.compressCorridors:
+                self.nodeUtilities = list(memoUtilities)
+            elif self.backend == "numpy":
+                self.expectedUtilities = np.array(memoUtilities, dtype=float)
+            else:
+                self.expectedUtilities = list(memoUtilities)
+            self.sweepQueue = []
+            self.preparationOverBudget = False
+            if not self.quiet:
+                print ("situation already solved, memo hits:", self.situationMemo.hits)
+        else:
+            self.finalResidual = float("inf") # not known until the first sweep, which anytime mode may not get to
+            if self.horizon is None: # a horizon solve only works out the rewards inside its window
+                self.calculateCellRewards(state) # food and ghost utilities only need working out once per move
+            # the work before the solve is kept small so the budget goes to sweeping, this reports when it didn't
+            self.preparationOverBudget = self.deadline is not None and time.time() >= self.deadline
+            if self.preparationOverBudget and not self.quiet:
+                print ("time budget used up before the first sweep")
+
+            if self.incremental:
+                self.runPrioritizedSweeping()
+                self.queueCarriedOver = True
+                if not self.quiet:
+                    print ("number of backups carried out:", self.backupCount)
+            else:
+                self.solve(state)
+                if not self.quiet:
+                    print ("number of iterations carried out:", self.iterationCount)  
+
+            self.converged = self.finalResidual <= self.residualThreshold()
+            if self.timeBudget is not None and not self.quiet:
+                if self.incremental:
+                    print ("backups within the time budget:", self.backupCount, "final residual:", self.finalResidual)
+                else:
+                    print ("sweeps within the time budget:", self.iterationCount, "final residual:", self.finalResidual)
+
+            # a solve cut short by the deadline isn't memoized so the situation gets more time when it comes back, and
+            # neither is an unconverged incremental solve (its queue carries the rest of the work over to the next move)
+            if situationKey is not None and ((self.timeBudget is None and not self.incremental) or self.converged):
+                self.situationMemo.store(situationKey, self.nodeUtilities if self.compressCorridors else self.expectedUtilities)
+
+        if self.compressCorridors:
+            # only the cells pacman can move to are expanded back from the junction graph
+            for cell in ((pacman[0], pacman[1]+1), (pacman[0]-1, pacman[1]), (pacman[0], pacman[1]-1), (pacman[0]+1, pacman[1])):
+                if cell in self.cellIndex:
+                    self.expectedUtilities[self.cellIndex[cell]] = self.getCellUtility(self.cellIndex[cell])
+        elif (self.horizon is None and self.layoutEntry is not None and self.layoutEntry["utilities"] is None
+              and memoUtilities is None and self.converged):
+            # the utilities of the first converged solve on a layout become its warm start values (a solve cut short by
+            # maxIterations or the deadline isn't stored, so a later converged one still gets its place)
+            self.layoutCache.storeUtilities(self.layoutFingerprint, self.layoutEntry, self.expectedUtilities)
+
+        if instrumented:
+            selectionStart = time.time()
         possibleExpectedUtilityMoves = [] # array that will store possible expected utlities based on the legal moves that pacman can carry out
         moveIndexes = [] # array that will store indexes for the moves for each expected utility 
         for i in range(len(legal)):  # iterating through all legal moves
             if legal[i] == "West":
                 westCell = (pacman[0]-1, pacman[1])  #westCell variable to establish a tuple (x,y) which is to the west of pacman
-                expectedUtilityOfMoveIndex = self.coordinatesOfEachEXField.index(westCell) # get index based on the coordinates of a expected utility of the west cell
+                expectedUtilityOfMoveIndex = self.cellIndex[westCell] # get index based on the coordinates of a expected utility of the west cell
                 possibleExpectedUtilityMoves.append(self.expectedUtilities[expectedUtilityOfMoveIndex]) # expected utility of the west cell of pacman stored in possible expected utility moves
                 moveIndexes.append("West") # under the same index, a move reference is stored which in this case is "West"
             # same procedure carried out in this If logic to establish the expected utilities and possible moves that pacman can carry out
             elif legal[i] == "East":
                 eastCell = (pacman[0]+1, pacman[1])
-                expectedUtilityOfMoveIndex = self.coordinatesOfEachEXField.index(eastCell)
+                expectedUtilityOfMoveIndex = self.cellIndex[eastCell]
                 possibleExpectedUtilityMoves.append(self.expectedUtilities[expectedUtilityOfMoveIndex])
                 moveIndexes.append("East")
             elif legal[i] == "North":
                 northCell = (pacman[0], pacman[1]+1)
-                expectedUtilityOfMoveIndex = self.coordinatesOfEachEXField.index(northCell)
+                expectedUtilityOfMoveIndex = self.cellIndex[northCell]
                 possibleExpectedUtilityMoves.append(self.expectedUtilities[expectedUtilityOfMoveIndex])
                 moveIndexes.append("North")
             elif legal[i] == "South":
                 southCell = (pacman[0], pacman[1]-1)
-                expectedUtilityOfMoveIndex = self.coordinatesOfEachEXField.index(southCell)
+                expectedUtilityOfMoveIndex = self.cellIndex[southCell]
                 possibleExpectedUtilityMoves.append(self.expectedUtilities[expectedUtilityOfMoveIndex])
                 moveIndexes.append("South")
         
         maxUtilityMoveIndex = possibleExpectedUtilityMoves.index(max(possibleExpectedUtilityMoves)) # index of maximum utility is stored 
         maxUtilityMove = moveIndexes[maxUtilityMoveIndex] # the move that corresponds to that utility is picked and stored in maxUtilityMove variable
+        if instrumented:
+            self.recordMove(moveStart, solveStart, selectionStart, memoUtilities is not None)
         if maxUtilityMove in legal :
             return api.makeMove(maxUtilityMove, legal) # maxUtilityMove is carried out by pacman
 
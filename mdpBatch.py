@@ -0,0 +1,393 @@
+# mdpBatch.py
+#
+# Batch runner for the MDPAgent in mdpAgents.py.
+#
+# Plays many games with a pool of worker processes (one per core by default)
+# and reports the win rate, score and move latency of every agent
+# configuration. Where the Pacman code (pacman.py, game.py, layout.py,
+# ghostAgents.py, textDisplay.py and api.py) can be imported, the games are
+# played through the game loop of pacman.py without graphics. Otherwise they
+# are played on the stand-in game of mdpBenchmark.py, which has no capsules
+# and so never has scared ghosts: results from it are labelled as such, and
+# the options for edible ghosts can't be tuned on it. Either way a game only
+# depends on its seed, so every configuration is played on the same games.
+#
+# Parameters can be swept over a grid (every combination of the -p values)
+# or sampled at random (--random N, with lo:hi ranges). Every finished game is
+# appended to a checkpoint file, and a run that is started again with the same
+# checkpoint skips the games it already has.
+#
+# Usage:
+#
+#   python mdpBatch.py -l mediumClassic -g 100
+#   python mdpBatch.py -l smallGrid,mediumClassic -g 50 -p foodCost=1,1.5,2 -p gamma=0.9,0.95
+#   python mdpBatch.py -l mediumClassic -g 50 --random 20 -p ghostCost=-20:-5 -p avoidDistance=2,3,4
+#   python mdpBatch.py -l layouts/mediumClassic.lay -g 100 -a solver=gaussSeidel -c run.jsonl -o run.csv
+#   python mdpBatch.py -l mediumClassic -g 100 --game standin   (the stand-in game even with pacman.py there)
+#
+# Layouts are the ones of mdpBenchmark.py (smallGrid, mediumClassic, mazeN)
+# or the path of a layout file. With pacman.py, smallGrid and mediumClassic
+# are read from its layouts directory, capsules included. -a gives options shared by all configurations
+# in the key=value,key=value form of pacman.py.
+
+import sys
+import os
+import time
+import random
+import math
+import json
+import itertools
+import signal
+import imp
+import optparse
+import multiprocessing
+
+import mdpBenchmark
+
+#
+# Configurations
+#
+
+# Turn a parameter value from the command line into a number where it is one.
+def parseValue(text):
+    for convert in (int, float):
+        try:
+            return convert(text)
+        except ValueError:
+            pass
+    return text
+
+# Parse the -p options into a list of (name, values) for a grid, or (name, (lo, hi)) for a range.
+def parseParameters(texts):
+    parameters = []
+    for text in texts:
+        if "=" not in text:
+            raise ValueError("Parameter must be name=values: %s" % text)
+        name, values = text.split("=", 1)
+        if ":" in values:
+            lo, hi = values.split(":", 1)
+            parameters.append((name, (float(lo), float(hi))))
+        else:
+            parameters.append((name, [parseValue(value) for value in values.split(",")]))
+    return parameters
+
+# Every combination of the parameter values. A range only has its two ends in a grid.
+def gridConfigurations(parameters):
+    names = [name for name, values in parameters]
+    choices = [list(values) for name, values in parameters]
+    return [dict(zip(names, combination)) for combination in itertools.product(*choices)]
+
+# Agent options that only take whole numbers. A range of one of these is sampled as an int, any other range as a float.
+integerParameters = ("smallGridAvoidDistance", "avoidDistance", "horizon", "maxIterations", "evaluationSweeps",
+                     "workers", "cacheSize", "memoBytes")
+
+# Random configurations: a value list is sampled uniformly, a range uniformly in [lo, hi]
+# (an int for the integerParameters, a float for the rest, whatever the ends look like).
+def randomConfigurations(parameters, count, seed):
+    rng = random.Random(seed)
+    configurations = []
+    for i in range(count):
+        configuration = {}
+        for name, values in parameters:
+            if isinstance(values, tuple):
+                lo, hi = values
+                if name in integerParameters:
+                    configuration[name] = rng.randint(int(math.ceil(lo)), int(math.floor(hi)))
+                else:
+                    configuration[name] = round(rng.uniform(lo, hi), 4)
+            else:
+                configuration[name] = rng.choice(values)
+        configurations.append(configuration)
+    return configurations
+
+# A stable name for a configuration, used in the checkpoint and the summary.
+def configurationKey(layoutName, configuration):
+    if not configuration:
+        return layoutName
+    return layoutName + "|" + ",".join("%s=%s" % (name, configuration[name]) for name in sorted(configuration))
+
+# The options a run shares between all its configurations (the -a agent options, the move limit and the game the
+# games are played on). They are stored with every game in the checkpoint, so a run with different ones doesn't pick
+# up games played under these.
+def runSettings(agentArgs, maxMoves, gameKind):
+    return ",".join("%s=%s" % (name, agentArgs[name]) for name in sorted(agentArgs)) + "|maxMoves=%d|game=%s" % (
+        maxMoves, gameKind)
+
+#
+# Games
+#
+
+# The modules of the Pacman code a game through pacman.py needs.
+pacmanModules = ("pacman", "game", "layout", "ghostAgents", "textDisplay", "api")
+
+# Agent options that only matter when a ghost is scared, which never happens in the stand-in game.
+edibleGhostParameters = ("edibleGhostCost",)
+
+# Whether the Pacman code can be imported (from the directory of this script or the Python path).
+def pacmanAvailable():
+    for name in pacmanModules:
+        try:
+            imp.find_module(name)
+        except ImportError:
+            return False
+    return True
+
+# The game the games are played on: "pacman" or "standin". "auto" picks pacman.py where it can be imported.
+def chooseGame(requested):
+    if requested == "auto":
+        return "pacman" if pacmanAvailable() else "standin"
+    if requested == "pacman" and not pacmanAvailable():
+        raise ValueError("pacman.py can't be imported from here (it needs %s)" % ", ".join(pacmanModules))
+    return requested
+
+#
+# Workers
+#
+
+# Runs once in every worker: for the stand-in game, put the stand-in Pacman modules in place before mdpAgents is
+# imported. Ctrl-C is left to the main process, which stops the pool.
+def initWorker(gameKind):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if gameKind == "standin":
+        mdpBenchmark.installStandIns()
+
+# Play one game on the stand-in game of mdpBenchmark.py. Returns the result, the score and the move latencies.
+def playStandInGame(agent, layoutName, seed, maxMoves):
+    layoutText = mdpBenchmark.getLayoutText(layoutName, seed)
+    rng = random.Random(seed)
+    state = mdpBenchmark.StandInState(layoutText)
+    agent.registerInitialState(state)
+
+    latencies = []
+    result = None
+    while result is None and len(latencies) < maxMoves:
+        start = time.time()
+        direction = agent.getAction(state)
+        latencies.append(time.time() - start)
+        result = mdpBenchmark.advance(state, direction, rng)
+    agent.final(state)
+    return result, state.score, latencies
+
+# Play one game through the game loop of pacman.py, with random ghosts and no graphics, the way
+# "python pacman.py -q -p MDPAgent -l layoutName" would. The global random generator drives the noise of the api
+# and the ghosts, so it is seeded. Once maxMoves moves are timed the agent stops and ends the game.
+def playPacmanGame(agent, layoutName, seed, maxMoves):
+    import pacman
+    import layout
+    import ghostAgents
+    import textDisplay
+    random.seed(seed)
+    gameLayout = layout.getLayout(layoutName)
+    if gameLayout is None: # not a layout of the Pacman code, so a generated maze
+        gameLayout = layout.Layout(mdpBenchmark.getLayoutText(layoutName, seed).split("\n"))
+    ghosts = [ghostAgents.RandomGhost(i + 1) for i in range(gameLayout.getNumGhosts())]
+    game = pacman.ClassicGameRules().newGame(gameLayout, agent, ghosts, textDisplay.NullGraphics(), quiet=True)
+
+    latencies = []
+    getAction = agent.getAction
+    def timedGetAction(state):
+        if len(latencies) >= maxMoves:
+            game.gameOver = True
+            return pacman.Directions.STOP
+        start = time.time()
+        direction = getAction(state)
+        latencies.append(time.time() - start)
+        return direction
+    agent.getAction = timedGetAction
+    game.run() # calls registerInitialState and final
+
+    state = game.state
+    result = "win" if state.isWin() else "lose" if state.isLose() else None
+    return result, state.getScore(), latencies
+
+# Play one game and return its result. Every game gets a new agent with a cache of its own, so a
+# result doesn't depend on the games the worker played before it.
+def playGame(task):
+    layoutName, configuration, agentArgs, seed, maxMoves, gameKind, settings = task
+    import mdpAgents
+    options = dict(agentArgs)
+    options.update(configuration)
+    options.setdefault("quiet", True)
+    options.setdefault("cacheSize", 1)
+
+    agent = mdpAgents.MDPAgent(**options)
+    if gameKind == "pacman":
+        result, score, latencies = playPacmanGame(agent, layoutName, seed, maxMoves)
+    else:
+        result, score, latencies = playStandInGame(agent, layoutName, seed, maxMoves)
+
+    return {"key": configurationKey(layoutName, configuration),
+            "layout": layoutName,
+            "configuration": configuration,
+            "game": gameKind,
+            "settings": settings,
+            "seed": seed,
+            "result": result or "timeout",
+            "score": score,
+            "moves": len(latencies),
+            "meanMs": sum(latencies) / max(len(latencies), 1) * 1000,
+            "p90Ms": mdpBenchmark.percentile(latencies, 0.9) * 1000}
+
+#
+# Checkpoint and summary
+#
+
+# Results of an earlier run, keyed by (configuration key, seed, run settings).
+def readCheckpoint(path):
+    done = {}
+    if not path or not os.path.exists(path):
+        return done
+    f = open(path)
+    try:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue # a line cut short when the run was stopped
+            done[(record["key"], record["seed"], record.get("settings"))] = record
+    finally:
+        f.close()
+    return done
+
+def summarise(records):
+    groups = {}
+    for record in records:
+        groups.setdefault(record["key"], []).append(record)
+    summary = []
+    for key in sorted(groups):
+        group = groups[key]
+        games = len(group)
+        wins = sum(1 for record in group if record["result"] == "win")
+        moveLatencies = [record["meanMs"] for record in group]
+        summary.append({"key": key,
+                        "layout": group[0]["layout"],
+                        "game": group[0]["game"],
+                        "configuration": group[0]["configuration"],
+                        "games": games,
+                        "wins": wins,
+                        "winRate": float(wins) / games,
+                        "meanScore": float(sum(record["score"] for record in group)) / games,
+                        "meanMoves": float(sum(record["moves"] for record in group)) / games,
+                        "meanMs": sum(moveLatencies) / games,
+                        "p90Ms": mdpBenchmark.percentile([record["p90Ms"] for record in group], 0.9)})
+    summary.sort(key=lambda row: (row["layout"], -row["winRate"], -row["meanScore"]))
+    return summary
+
+# What the games were played on, printed above the summary table.
+gameLabels = {"pacman": "Games played through pacman.py",
+              "standin": "Games played on the stand-in game of mdpBenchmark.py, not pacman.py (no capsules, so the"
+                         " ghosts are never scared)"}
+
+def printSummary(summary, gameKind):
+    print
+    print gameLabels[gameKind]
+    print "%-44s %6s %6s %7s %9s %8s %8s %8s" % (
+        "configuration", "games", "wins", "win %", "score", "moves", "mean ms", "p90 ms")
+    for row in summary:
+        print "%-44s %6d %6d %7.1f %9.1f %8.1f %8.2f %8.2f" % (
+            row["key"], row["games"], row["wins"], row["winRate"] * 100, row["meanScore"],
+            row["meanMoves"], row["meanMs"], row["p90Ms"])
+
+def writeSummary(summary, path):
+    names = sorted(set(name for row in summary for name in row["configuration"]))
+    f = open(path, "w")
+    try:
+        f.write(",".join(["layout", "game"] + names + ["games", "wins", "winRate", "meanScore", "meanMoves", "meanMs", "p90Ms"]) + "\n")
+        for row in summary:
+            values = [row["layout"], row["game"]] + [row["configuration"].get(name, "") for name in names]
+            values += [row["games"], row["wins"], "%.4f" % row["winRate"], "%.2f" % row["meanScore"],
+                       "%.2f" % row["meanMoves"], "%.3f" % row["meanMs"], "%.3f" % row["p90Ms"]]
+            f.write(",".join(str(value) for value in values) + "\n")
+    finally:
+        f.close()
+
+def main(argv):
+    parser = optparse.OptionParser(usage="python mdpBatch.py [options]")
+    parser.add_option("-l", "--layouts", default="mediumClassic",
+                      help="comma separated layouts: smallGrid, mediumClassic, mazeN or a layout file [default: %default]")
+    parser.add_option("-g", "--games", type="int", default=20, help="games per configuration and layout [default: %default]")
+    parser.add_option("-p", "--parameter", action="append", default=[],
+                      help="agent parameter to sweep as name=v1,v2,... or name=lo:hi; repeat for more parameters")
+    parser.add_option("-r", "--random", type="int", default=0,
+                      help="sample this many random configurations instead of the full grid")
+    parser.add_option("-a", "--agentArgs", default="", help="agent options shared by all configurations, as key=value,key=value")
+    parser.add_option("-w", "--workers", type="int", default=multiprocessing.cpu_count(),
+                      help="worker processes [default: %default]")
+    parser.add_option("-s", "--seed", type="int", default=0, help="seed of the games and the random configurations [default: %default]")
+    parser.add_option("-m", "--maxMoves", type="int", default=1000,
+                      help="moves after which a game is stopped and counted as a timeout [default: %default]")
+    parser.add_option("-c", "--checkpoint", default="mdpBatch.jsonl", help="file every finished game is appended to [default: %default]")
+    parser.add_option("-o", "--output", default="mdpBatch.csv", help="summary CSV [default: %default]")
+    parser.add_option("--game", default="auto", choices=["auto", "pacman", "standin"],
+                      help="play through pacman.py or on the stand-in game of mdpBenchmark.py; auto uses pacman.py"
+                           " where it can be imported [default: %default]")
+    options, args = parser.parse_args(argv)
+
+    parameters = parseParameters(options.parameter)
+    if options.random:
+        configurations = randomConfigurations(parameters, options.random, options.seed)
+    else:
+        configurations = gridConfigurations(parameters)
+    agentArgs = mdpBenchmark.parseAgentArgs(options.agentArgs)
+    if "parallel" in [agentArgs.get("solver")] + [configuration.get("solver") for configuration in configurations]:
+        # pool workers can't start processes of their own, and the games already keep every core busy
+        parser.error("the parallel solver can't be used in a batch run, the games are spread over the cores instead")
+    try:
+        gameKind = chooseGame(options.game)
+    except ValueError, error:
+        parser.error(str(error))
+    tuned = set(agentArgs) | set(name for name, values in parameters)
+    if gameKind == "standin" and tuned & set(edibleGhostParameters):
+        # nothing in the stand-in game depends on them, so any value would do as well as any other
+        parser.error("%s can't be tuned on the stand-in game, it has no scared ghosts (run where pacman.py is)"
+                     % ", ".join(sorted(tuned & set(edibleGhostParameters))))
+
+    # The same seeds for every configuration, so they are compared on the same games.
+    seeds = [options.seed * 1000003 + game for game in range(options.games)]
+    done = readCheckpoint(options.checkpoint)
+    settings = runSettings(agentArgs, options.maxMoves, gameKind)
+    tasks = []
+    records = []
+    for layoutName in options.layouts.split(","):
+        for configuration in configurations:
+            key = configurationKey(layoutName, configuration)
+            for seed in seeds:
+                if (key, seed, settings) in done:
+                    records.append(done[(key, seed, settings)])
+                else:
+                    tasks.append((layoutName, configuration, agentArgs, seed, options.maxMoves, gameKind, settings))
+    print "%d configurations, %d games to play (%d from %s) on %s" % (
+        len(configurations), len(tasks), len(records), options.checkpoint,
+        "pacman.py" if gameKind == "pacman" else "the stand-in game")
+
+    pool = multiprocessing.Pool(max(options.workers, 1), initWorker, (gameKind,))
+    checkpoint = open(options.checkpoint, "a", 1)
+    start = time.time()
+    try:
+        # imap_unordered with a timeout on next() so a Ctrl-C reaches the main process.
+        results = pool.imap_unordered(playGame, tasks)
+        for i in range(len(tasks)):
+            record = results.next(timeout=sys.maxint)
+            checkpoint.write(json.dumps(record, sort_keys=True) + "\n")
+            records.append(record)
+            if (i + 1) % 50 == 0:
+                print "%d/%d games, %.1fs" % (i + 1, len(tasks), time.time() - start)
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        print "Stopped: %d games kept in %s, run again to go on" % (len(records), options.checkpoint)
+    except Exception:
+        # a game failed (a bad option, say): stop the other workers and let its error through
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        checkpoint.close()
+
+    summary = summarise(records)
+    printSummary(summary, gameKind)
+    if options.output:
+        writeSummary(summary, options.output)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
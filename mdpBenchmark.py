@@ -0,0 +1,430 @@
+# mdpBenchmark.py
+#
+# Headless benchmark for the MDPAgent in mdpAgents.py.
+#
+# The agent normally runs inside the Berkeley Pacman code (pacman.py, game.py
+# and the api module), which needs a full game with graphics. This script puts
+# small stand-ins for the api, pacman, game and util modules in place instead,
+# so registerInitialState, getAction and the value iteration core can be timed
+# on their own, on the classic layouts and on generated mazes up to 200x200.
+#
+# For every layout it reports the per-move latency percentiles, the sweeps per
+# solve, the memory footprint of the agent and the time of a single Bellman
+# sweep, followed by how these scale with the number of open cells.
+#
+# Usage:
+#
+#   python mdpBenchmark.py
+#   python mdpBenchmark.py -l smallGrid,mediumClassic,maze100 -m 50
+#   python mdpBenchmark.py -a backend=python -a backend=numpy   (compare two configurations)
+#   python mdpBenchmark.py -j results.json                      (also write the results as JSON)
+#
+# Layouts are smallGrid, mediumClassic and mazeN (an NxN generated maze).
+# Every -a gives one agent configuration in the same key=value,key=value form
+# as the -a option of pacman.py.
+
+import sys
+import types
+import random
+import time
+import math
+import json
+import optparse
+import os
+
+# The classic layouts, as in the layouts directory of the Pacman code. Capsules (o) are left out
+# since the stand-in game has no edible ghosts.
+smallGrid = """%%%%%%%
+%    .%
+% %%% %
+% %%% %
+%.%%% %
+%P   G%
+%%%%%%%"""
+
+mediumClassic = """%%%%%%%%%%%%%%%%%%%%
+%....%........%....%
+%.%%.%.%%%%%%.%.%%.%
+%.%..............%.%
+%.%.%%.%%  %%.%%.%.%
+%......%G  G%......%
+%.%.%%.%%%%%%.%%.%.%
+%.%..............%.%
+%.%%.%.%%%%%%.%.%%.%
+%....%...P....%....%
+%%%%%%%%%%%%%%%%%%%%"""
+
+directionSteps = {"North": (0, 1), "South": (0, -1), "East": (1, 0), "West": (-1, 0), "Stop": (0, 0)}
+sideSteps = {"North": ("West", "East"), "South": ("East", "West"),
+             "East": ("North", "South"), "West": ("South", "North")}
+reverseDirections = {"North": "South", "South": "North", "East": "West", "West": "East", "Stop": "Stop"}
+
+#
+# Layout generation
+#
+
+# Generate an NxN maze: a depth first search carves corridors between the odd cells, then some
+# of the remaining inner walls are knocked down so the maze has loops like the Pacman layouts do.
+# Every open cell gets food, pacman starts near the bottom left and two ghosts in the middle.
+def generateMaze(size, seed, loopChance=0.15):
+    rng = random.Random(seed)
+    size = max(size, 7)
+    cells = [['%'] * size for y in range(size)]
+    stack = [(1, 1)]
+    cells[1][1] = '.'
+    while stack:
+        x, y = stack[-1]
+        options = []
+        for dx, dy in ((2, 0), (-2, 0), (0, 2), (0, -2)):
+            nx, ny = x + dx, y + dy
+            if 0 < nx < size - 1 and 0 < ny < size - 1 and cells[ny][nx] == '%':
+                options.append((nx, ny, dx, dy))
+        if not options:
+            stack.pop()
+            continue
+        nx, ny, dx, dy = rng.choice(options)
+        cells[y + dy // 2][x + dx // 2] = '.'
+        cells[ny][nx] = '.'
+        stack.append((nx, ny))
+
+    for y in range(1, size - 1):
+        for x in range(1, size - 1):
+            if cells[y][x] == '%' and rng.random() < loopChance:
+                horizontal = cells[y][x-1] != '%' and cells[y][x+1] != '%'
+                vertical = cells[y-1][x] != '%' and cells[y+1][x] != '%'
+                if horizontal or vertical:
+                    cells[y][x] = '.'
+
+    openCells = [(x, y) for y in range(size) for x in range(size) if cells[y][x] != '%']
+    openCells.sort(key=lambda cell: (cell[0] + cell[1], cell))
+    pacmanCell = openCells[0]
+    middle = sorted(openCells, key=lambda cell: abs(cell[0] - size // 2) + abs(cell[1] - size // 2))
+    for x, y in middle[:2]:
+        cells[y][x] = 'G'
+    cells[pacmanCell[1]][pacmanCell[0]] = 'P'
+    return "\n".join("".join(row) for row in reversed(cells))
+
+# Return the text of a layout from its name, or read it from a layout file (a .lay file from the
+# layouts directory of the Pacman code).
+def getLayoutText(name, seed):
+    if os.path.isfile(name):
+        f = open(name)
+        try:
+            return "\n".join(line.rstrip() for line in f if line.strip())
+        finally:
+            f.close()
+    if name == "smallGrid":
+        return smallGrid
+    if name == "mediumClassic":
+        return mediumClassic
+    if name.startswith("maze"):
+        return generateMaze(int(name[len("maze"):]), seed)
+    raise ValueError("Unknown layout: %s" % name)
+
+#
+# Stand-in game
+#
+
+# The game state handed to the agent. It only holds what the stand-in api reads, plus the score
+# (kept the way the Pacman code keeps it: -1 a move, +10 a food, +500 for a win and -500 for a loss).
+class StandInState:
+    def __init__(self, layoutText):
+        rows = layoutText.split("\n")
+        self.height = len(rows)
+        self.width = len(rows[0])
+        self.walls = set()
+        self.food = set()
+        self.ghosts = []
+        self.pacman = None
+        self.score = 0
+        for row in range(self.height):
+            y = self.height - 1 - row
+            for x in range(self.width):
+                symbol = rows[row][x]
+                if symbol == '%':
+                    self.walls.add((x, y))
+                elif symbol == '.':
+                    self.food.add((x, y))
+                elif symbol == 'P':
+                    self.pacman = (x, y)
+                elif symbol == 'G':
+                    self.ghosts.append((x, y))
+        self.ghostDirections = ["Stop"] * len(self.ghosts)
+        self.openCellCount = self.width * self.height - len(self.walls)
+
+    def legalDirections(self, position):
+        legal = []
+        for direction in ("North", "South", "East", "West"):
+            dx, dy = directionSteps[direction]
+            if (position[0] + dx, position[1] + dy) not in self.walls:
+                legal.append(direction)
+        return legal
+
+# Build the stand-in api module. It has the same functions as the api module of the coursework,
+# as far as the agent uses them.
+def makeApiModule():
+    api = types.ModuleType("api")
+    api.corners = lambda state: [(0, 0), (state.width - 1, 0), (0, state.height - 1), (state.width - 1, state.height - 1)]
+    api.walls = lambda state: list(state.walls)
+    api.food = lambda state: list(state.food)
+    api.ghosts = lambda state: list(state.ghosts)
+    api.ghostStates = lambda state: [(ghost, 0) for ghost in state.ghosts]
+    api.whereAmI = lambda state: state.pacman
+    api.legalActions = lambda state: state.legalDirections(state.pacman) + ["Stop"]
+    api.makeMove = lambda direction, legal: direction
+    return api
+
+# Put the stand-ins for the Pacman modules in place so mdpAgents can be imported without them.
+def installStandIns():
+    pacman = types.ModuleType("pacman")
+    class Directions:
+        NORTH = "North"
+        SOUTH = "South"
+        EAST = "East"
+        WEST = "West"
+        STOP = "Stop"
+    pacman.Directions = Directions
+
+    game = types.ModuleType("game")
+    class Agent:
+        def __init__(self, index=0):
+            self.index = index
+    game.Agent = Agent
+
+    sys.modules["pacman"] = pacman
+    sys.modules["game"] = game
+    sys.modules["api"] = makeApiModule()
+    sys.modules["util"] = types.ModuleType("util")
+
+# Play the move the agent chose (with the same 0.8/0.1/0.1 noise as the real api), move the ghosts
+# at random and return "win", "lose" or None if the game goes on. The ghosts move like the random
+# ghosts of the Pacman code: they never stop and only turn back at a dead end.
+def advance(state, direction, rng):
+    if direction in sideSteps:
+        roll = rng.random()
+        if roll > 0.9:
+            direction = sideSteps[direction][0]
+        elif roll > 0.8:
+            direction = sideSteps[direction][1]
+    dx, dy = directionSteps.get(direction, (0, 0))
+    target = (state.pacman[0] + dx, state.pacman[1] + dy)
+    if target not in state.walls:
+        state.pacman = target
+    state.score -= 1
+    if state.pacman in state.food:
+        state.food.discard(state.pacman)
+        state.score += 10
+    if state.pacman in state.ghosts:
+        state.score -= 500
+        return "lose"
+    if not state.food:
+        state.score += 500
+        return "win"
+    for g, ghost in enumerate(state.ghosts):
+        legal = state.legalDirections(ghost)
+        if len(legal) > 1 and reverseDirections[state.ghostDirections[g]] in legal:
+            legal.remove(reverseDirections[state.ghostDirections[g]])
+        step = rng.choice(legal)
+        state.ghosts[g] = (ghost[0] + directionSteps[step][0], ghost[1] + directionSteps[step][1])
+        state.ghostDirections[g] = step
+    if state.pacman in state.ghosts:
+        state.score -= 500
+        return "lose"
+    return None
+
+#
+# Measurements
+#
+
+# Percentile (nearest rank) of a list of numbers.
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = int(math.ceil(fraction * len(ordered))) - 1
+    return ordered[min(max(rank, 0), len(ordered) - 1)]
+
+# Rough memory footprint of an object in bytes, following containers and object attributes.
+def estimateSize(obj, seen=None):
+    if seen is None:
+        seen = set()
+    if id(obj) in seen or isinstance(obj, (types.ModuleType, types.FunctionType, type)):
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if hasattr(obj, "nbytes") and hasattr(obj, "dtype"): # numpy array
+        return max(size, obj.nbytes)
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += estimateSize(key, seen) + estimateSize(value, seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for item in obj:
+            size += estimateSize(item, seen)
+    elif hasattr(obj, "__dict__"):
+        size += estimateSize(obj.__dict__, seen)
+    elif hasattr(obj, "__slots__"):
+        for name in obj.__slots__:
+            size += estimateSize(getattr(obj, name, None), seen)
+    return size
+
+# Peak resident memory of the process in kilobytes (0 where the resource module isn't available).
+def getPeakMemory():
+    try:
+        import resource
+    except ImportError:
+        return 0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+# Parse an agent configuration given as key=value,key=value (the -a format of pacman.py).
+def parseAgentArgs(text):
+    options = {}
+    if not text:
+        return options
+    for pair in text.split(","):
+        if "=" in pair:
+            key, value = pair.split("=", 1)
+        else:
+            key, value = pair, 1
+        options[key] = value
+    return options
+
+# Give the agents created from here on a new, empty shared layout cache. Every measurement starts
+# with one so a configuration doesn't get the setup and warm utilities of the ones run before it.
+def resetLayoutCache(mdpAgents):
+    mdpAgents.sharedLayoutCache = mdpAgents.LayoutCache()
+
+# Time one Bellman sweep of the value iteration core on the initial state of a layout (a sweep over
+# the junction graph when the agent compresses corridors, over the window around pacman in horizon mode
+# and by the worker processes for the parallel solver).
+def timeSweep(mdpAgents, agentArgs, layoutText, repeats=3):
+    resetLayoutCache(mdpAgents)
+    state = StandInState(layoutText)
+    agent = mdpAgents.MDPAgent(**agentArgs)
+    agent.registerInitialState(state)
+    if agent.horizon is not None:
+        agent.calculateHorizonWindow(state)
+    else:
+        agent.calculateCellRewards(state)
+    if agent.solver == "parallel":
+        agent.loadTiledSolver()
+    best = None
+    for i in range(repeats):
+        start = time.time()
+        if agent.solver == "parallel":
+            agent.tiledSolver.sweep(0, agent.emptyTileCost, agent.gamma, True)
+        elif agent.horizon is not None:
+            agent.sweepHorizonWindow()
+        elif agent.compressCorridors:
+            agent.calculateNextNodeValues()
+        elif agent.backend == "numpy":
+            agent.calculateNextIterationValuesNumpy()
+        else:
+            agent.calculateNextIterationValues(state)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+# Benchmark one agent configuration on one layout. Games are replayed (new game on a win or a
+# loss, with final and registerInitialState in between) until the number of moves is reached.
+def benchmarkLayout(mdpAgents, agentArgs, layoutName, moves, seed):
+    layoutText = getLayoutText(layoutName, seed)
+    rng = random.Random(seed)
+    resetLayoutCache(mdpAgents) # games after the first on the layout still reuse it, as they would in pacman.py
+    agent = mdpAgents.MDPAgent(**agentArgs)
+    state = StandInState(layoutText)
+
+    start = time.time()
+    agent.registerInitialState(state)
+    setupTime = time.time() - start
+
+    latencies = []
+    sweeps = []
+    games = 0
+    wins = 0
+    while len(latencies) < moves:
+        start = time.time()
+        direction = agent.getAction(state)
+        latencies.append(time.time() - start)
+        sweeps.append(agent.backupCount if agent.incremental else agent.iterationCount)
+        result = advance(state, direction, rng)
+        if result is not None:
+            games += 1
+            wins += result == "win"
+            agent.final(state)
+            state = StandInState(layoutText)
+            agent.registerInitialState(state)
+
+    return {"layout": layoutName,
+            "openCells": state.openCellCount,
+            "setupMs": setupTime * 1000,
+            "moves": len(latencies),
+            "p50Ms": percentile(latencies, 0.5) * 1000,
+            "p90Ms": percentile(latencies, 0.9) * 1000,
+            "p99Ms": percentile(latencies, 0.99) * 1000,
+            "maxMs": max(latencies) * 1000,
+            "meanSweeps": float(sum(sweeps)) / len(sweeps),
+            "sweepMs": timeSweep(mdpAgents, agentArgs, layoutText) * 1000,
+            "agentKb": estimateSize(agent, set([id(agent.layoutCache)])) / 1024.0, # the layout cache is shared between agents
+            "peakKb": getPeakMemory(),
+            "games": games,
+            "wins": wins}
+
+# Slope of log(y) against log(x): how the cost grows with the number of open cells (1 is linear).
+def scalingExponent(points):
+    points = [(math.log(x), math.log(y)) for x, y in points if x > 0 and y > 0]
+    if len(points) < 2:
+        return None
+    meanX = sum(x for x, y in points) / len(points)
+    meanY = sum(y for x, y in points) / len(points)
+    spread = sum((x - meanX) ** 2 for x, y in points)
+    if spread == 0:
+        return None
+    return sum((x - meanX) * (y - meanY) for x, y in points) / spread
+
+def printReport(configuration, results):
+    print
+    print "Agent options:", configuration or "(defaults)"
+    print "%-14s %7s %9s %8s %8s %8s %8s %7s %9s %10s %6s" % (
+        "layout", "cells", "setup ms", "p50 ms", "p90 ms", "p99 ms", "max ms", "sweeps", "sweep ms", "agent KB", "wins")
+    for result in results:
+        print "%-14s %7d %9.1f %8.2f %8.2f %8.2f %8.2f %7.1f %9.3f %10.1f %3d/%-2d" % (
+            result["layout"], result["openCells"], result["setupMs"], result["p50Ms"], result["p90Ms"],
+            result["p99Ms"], result["maxMs"], result["meanSweeps"], result["sweepMs"], result["agentKb"],
+            result["wins"], result["games"])
+    for label, key in (("p50 move latency", "p50Ms"), ("sweep time", "sweepMs"), ("agent memory", "agentKb")):
+        exponent = scalingExponent([(result["openCells"], result[key]) for result in results])
+        if exponent is not None:
+            print "%s grows as cells^%.2f" % (label, exponent)
+
+def main(argv):
+    parser = optparse.OptionParser(usage="python mdpBenchmark.py [options]")
+    parser.add_option("-l", "--layouts", default="smallGrid,mediumClassic,maze50,maze100,maze200",
+                      help="comma separated layouts: smallGrid, mediumClassic or mazeN [default: %default]")
+    parser.add_option("-m", "--moves", type="int", default=30, help="moves timed per layout [default: %default]")
+    parser.add_option("-s", "--seed", type="int", default=0, help="seed for the mazes, the noise and the ghosts [default: %default]")
+    parser.add_option("-a", "--agentArgs", action="append", default=[],
+                      help="agent configuration as key=value,key=value; repeat to compare configurations")
+    parser.add_option("-j", "--json", default=None, help="also write the results to this file as JSON")
+    options, args = parser.parse_args(argv)
+
+    installStandIns()
+    import mdpAgents
+
+    report = []
+    for configuration in options.agentArgs or [""]:
+        agentArgs = parseAgentArgs(configuration)
+        agentArgs.setdefault("quiet", True)
+        results = [benchmarkLayout(mdpAgents, agentArgs, layoutName, options.moves, options.seed)
+                   for layoutName in options.layouts.split(",")]
+        printReport(configuration, results)
+        report.append({"agentArgs": agentArgs, "results": results})
+
+    if options.json:
+        f = open(options.json, "w")
+        try:
+            json.dump(report, f, indent=2, sort_keys=True)
+        finally:
+            f.close()
+
+if __name__ == "__main__":
+    main(sys.argv[1:])